@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Measure how long it takes to bring up the database plugin
+
+Compares running the Alembic upgrade on every start against the
+migration guard, both for a fresh process and for a process that has
+already checked the database, and times the first use of a Handler
+(building Missions, then the database behind it, in a fresh process).
+"""
+
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+
+import alembic.command
+import alembic.config
+import synack
+
+from synack.plugins import db
+
+
+def run_alembic(sqlite_db):
+    db_folder = pathlib.Path(db.__file__).parent.parent / 'db'
+    config = alembic.config.Config()
+    config.set_main_option('script_location', str(db_folder / 'alembic'))
+    config.set_main_option('version_locations', str(db_folder / 'alembic/versions'))
+    config.set_main_option('sqlalchemy.url', f'sqlite:///{sqlite_db}')
+    alembic.command.upgrade(config, 'head')
+
+
+def timed(func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-r', '--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state = synack.State()
+        state.config_dir = tmp
+        (state.config_dir / 'duo.json').write_text(json.dumps({}))
+        sqlite_db = state.config_dir / 'synackapi.db'
+        run_alembic(sqlite_db)
+
+        def cold_guard():
+            db._migrated.clear()
+            db.Db(state)
+
+        def cold_handler():
+            db._migrated.clear()
+            synack.Handler(state=state, login=False).missions.db
+
+        results = {
+            'alembic upgrade': timed(lambda: run_alembic(sqlite_db), args.rounds),
+            'guard, new process': timed(cold_guard, args.rounds),
+            'guard, already checked': timed(lambda: db.Db(state), args.rounds),
+            'Handler().missions.db': timed(cold_handler, args.rounds),
+        }
+
+    for name, ms in results.items():
+        print(f'{name:>24}: {ms:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Check that `import synack` stays within its import-time budget
+
+Runs `python -X importtime -c "import synack"` in a fresh interpreter and
+fails if any of the deferred dependencies were imported eagerly, or if the
+cumulative import time of the package exceeds the budget.
+"""
+
+import argparse
+import subprocess
+import sys
+
+DEFERRED = [
+    'alembic',
+    'bs4',
+    'Crypto',
+    'pyotp',
+    'smtplib',
+]
+
+
+def get_import_times(module):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          capture_output=True, text=True, check=True)
+    ret = dict()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        ret[name.strip()] = int(cumulative)
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-b', '--budget', type=float, default=600,
+                        help='Maximum cumulative import time in milliseconds')
+    parser.add_argument('-r', '--rounds', type=int, default=3,
+                        help='Number of runs; the fastest one is checked')
+    args = parser.parse_args()
+
+    runs = [get_import_times('synack') for _ in range(args.rounds)]
+    times = min(runs, key=lambda r: r.get('synack', 0))
+
+    errors = list()
+    for name in times.keys():
+        if name.split('.')[0] in DEFERRED:
+            errors.append(f'{name} is imported by `import synack`')
+
+    total = times.get('synack', 0) / 1000
+    if total > args.budget:
+        errors.append(f'`import synack` took {total:.1f} ms (budget: {args.budget:.1f} ms)')
+
+    for error in errors:
+        print(f'FAIL: {error}')
+    if not errors:
+        print(f'OK: `import synack` took {total:.1f} ms (budget: {args.budget:.1f} ms)')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
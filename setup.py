@@ -38,5 +38,9 @@ setuptools.setup(
         "requests",
         "bs4",
         "pycryptodome",
-    ]
+    ],
+    extras_require={
+        'async': ['aiohttp'],
+        'fast': ['orjson'],
+    }
 )
@@ -1,4 +1,7 @@
 # flake8: noqa
 
 from ._handler import Handler
+from ._poll import PollScheduler
+from ._ratelimit import RateLimiter
+from ._retry import RetryPolicy
 from ._state import State
@@ -0,0 +1,167 @@
+"""cache.py
+
+Conditional-GET response cache for read-mostly API endpoints.
+"""
+
+import collections
+import hashlib
+import json
+import pathlib
+import threading
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+CACHE_ENDPOINTS = [
+    r'^targets$',
+    r'^targets/registered_summary$',
+    r'^assessments$',
+    r'^profiles/me$',
+    r'^asset/v2/assets$',
+]
+
+
+class ResponseCache:
+    """Size-bounded LRU store of response bodies and their validators
+
+    Arguments:
+    max_bytes -- Total size of the bodies kept before the least recently
+                 used ones are evicted
+    path -- Directory to persist entries to, or None to keep them in memory
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, path=None):
+        self.max_bytes = max_bytes
+        self.path = pathlib.Path(path) if path else None
+        self.size = 0
+        self.hits = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if self.path:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def build_key(url, params=None, token=None):
+        """Return the cache key of a GET request
+
+        The API token is part of the key so entries are never shared between
+        accounts.
+        """
+        key = json.dumps([url, sorted((params or {}).items()), token], default=str)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @staticmethod
+    def build_validators(entry):
+        """Return the conditional request headers for a cached entry"""
+        ret = dict()
+        if entry.get('etag'):
+            ret['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            ret['If-Modified-Since'] = entry['last_modified']
+        return ret
+
+    def build_response(self, entry, res):
+        """Return a 200 response carrying a cached body
+
+        Arguments:
+        entry -- Cached entry the server confirmed with a 304
+        res -- The 304 response
+        """
+        ret = Response()
+        ret.status_code = 200
+        ret.reason = 'OK'
+        ret._content = entry['content']
+        ret.headers = CaseInsensitiveDict(entry['headers'])
+        for name in ('Cache-Control', 'Date', 'ETag', 'Expires', 'Last-Modified'):
+            if name in res.headers:
+                ret.headers[name] = res.headers[name]
+        ret.encoding = entry['encoding']
+        ret.url = res.url
+        # AsyncResponse has neither
+        ret.request = getattr(res, 'request', None)
+        ret.elapsed = getattr(res, 'elapsed', ret.elapsed)
+        ret.from_cache = True
+        self.hits += 1
+        return ret
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries.keys())
+            self._entries.clear()
+            self.size = 0
+        for key in keys:
+            self._remove_file(key)
+
+    def get(self, key):
+        """Return the entry stored for a key, if any"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._load_file(key)
+        if entry is not None:
+            self._store(key, entry)
+        return entry
+
+    def set(self, key, res):
+        """Store a response if it carries validators
+
+        Arguments:
+        key -- Cache key from build_key()
+        res -- 200 response to a GET request
+        """
+        etag = res.headers.get('ETag')
+        last_modified = res.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        entry = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': dict(res.headers),
+            'encoding': res.encoding,
+            'content': res.content,
+        }
+        if len(entry['content']) > self.max_bytes:
+            return
+        self._store(key, entry)
+        self._save_file(key, entry)
+
+    def _store(self, key, entry):
+        evicted = list()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old['content'])
+            self._entries[key] = entry
+            self.size += len(entry['content'])
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                old_key, old = self._entries.popitem(last=False)
+                self.size -= len(old['content'])
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._remove_file(old_key)
+
+    def _load_file(self, key):
+        if not self.path:
+            return None
+        try:
+            entry = json.loads((self.path / f'{key}.json').read_text())
+            entry['content'] = (self.path / f'{key}.body').read_bytes()
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def _remove_file(self, key):
+        if self.path:
+            for suffix in ('json', 'body'):
+                (self.path / f'{key}.{suffix}').unlink(missing_ok=True)
+
+    def _save_file(self, key, entry):
+        if self.path:
+            meta = {k: v for k, v in entry.items() if k != 'content'}
+            (self.path / f'{key}.body').write_bytes(entry['content'])
+            (self.path / f'{key}.json').write_text(json.dumps(meta))
@@ -15,12 +15,32 @@ class Handler:
             if hasattr(self.state, key):
                 setattr(self.state, key, kwargs.get(key))
 
-        for name, subclass in Plugin.registry.items():
-            instance = subclass(self.state)
-            setattr(self, name.lower(), instance)
+        self.plugins = dict()
+
+        if self.state.metrics_port is not None and self.state.metrics is not None:
+            self.state.metrics.serve(self.state.metrics_port)
 
         self.login()
 
+    def __getattr__(self, name):
+        """Build plugins the first time they are accessed (h.missions, h.hydra, etc.)"""
+        for plugin in Plugin.registry.keys():
+            if plugin.lower() == name and 'plugins' in self.__dict__:
+                value = self.get_plugin(plugin)
+                setattr(self, name, value)
+                return value
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def get_plugin(self, name):
+        """Return the shared instance of a plugin, building it if needed
+
+        Arguments:
+        name -- Name of the plugin class in the registry (Api, Db, etc.)
+        """
+        return Plugin.resolve(name, self.state, self.plugins)
+
     def login(self):
         if self.state.login:
             self.auth.get_api_token()
+            if self.state.use_token_refresh:
+                self.auth.set_refresh()
@@ -0,0 +1,97 @@
+"""json.py
+
+Fast JSON backend and responses that decode their body only once.
+"""
+
+import json
+
+import requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _orjson_dumps(obj, **kwargs):
+    if kwargs:
+        return json.dumps(obj, **kwargs)
+    return orjson.dumps(obj).decode()
+
+
+BACKENDS = {
+    'json': (json.loads, json.dumps),
+}
+if orjson is not None:
+    BACKENDS['orjson'] = (orjson.loads, _orjson_dumps)
+
+backend = 'orjson' if orjson is not None else 'json'
+_loads, _dumps = BACKENDS[backend]
+
+
+def dumps(obj, **kwargs):
+    """Serialize an object to a JSON string with the current backend"""
+    return _dumps(obj, **kwargs)
+
+
+def loads(data):
+    """Deserialize a JSON document (str or bytes) with the current backend"""
+    return _loads(data)
+
+
+def set_backend(name, loads=None, dumps=None):
+    """Select the JSON backend
+
+    Arguments:
+    name -- Name of a backend in BACKENDS ('json', 'orjson'), or a new name
+            to register with the given functions
+    loads -- Function decoding str or bytes, when registering a backend
+    dumps -- Function encoding to str, when registering a backend
+    """
+    global backend, _loads, _dumps
+    if loads is not None and dumps is not None:
+        BACKENDS[name] = (loads, dumps)
+    _loads, _dumps = BACKENDS[name]
+    backend = name
+
+
+class JsonResponse(requests.Response):
+    """requests.Response whose json() decodes the body once
+
+    The decoded body is kept and the same object is returned on every call,
+    so callers must copy it before changing it.
+    """
+
+    def json(self, **kwargs):
+        if kwargs:
+            return super().json(**kwargs)
+        try:
+            return self.__dict__['_json']
+        except KeyError:
+            pass
+        try:
+            ret = _loads(self.content)
+        except (TypeError, ValueError):
+            # Let requests handle other encodings and raise its usual error
+            ret = super().json()
+        self._json = ret
+        return ret
+
+
+def copy(res):
+    """Return a shallow copy of a response that decodes its body on its own
+
+    Callers handed the same response (see SingleFlight) each get a copy, so
+    changes one of them makes to the decoded body are not seen by the others.
+    """
+    ret = object.__new__(type(res))
+    ret.__dict__.update(res.__dict__)
+    ret.__dict__.pop('_json', None)
+    return ret
+
+
+def wrap(res):
+    """Turn a requests.Response into a JsonResponse in place and return it"""
+    if res is not None and type(res) is requests.Response:
+        res.__class__ = JsonResponse
+    return res
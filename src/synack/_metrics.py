@@ -0,0 +1,172 @@
+"""metrics.py
+
+Per-endpoint request metrics with a Prometheus text exporter.
+"""
+
+import bisect
+import collections
+import http.server
+import threading
+
+BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """Thread-safe counters, gauges and request latency histograms
+
+    Arguments:
+    buckets -- Upper bounds in seconds of the latency histogram buckets
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counters = collections.defaultdict(collections.Counter)
+        self.gauges = dict()
+        self.histograms = collections.defaultdict(dict)
+        self.server = None
+        self._help = dict()
+        self._lock = threading.Lock()
+
+    def count(self, name, value=1, help=None, **labels):
+        """Increase a counter
+
+        Arguments:
+        name -- Metric name (synack_api_retries_total, etc.)
+        value -- Amount to add
+        help -- Description shown in the exporter
+        labels -- Label names and values of the series
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.counters[name][key] += value
+            if help:
+                self._help[name] = help
+
+    def gauge(self, name, value, help=None, **labels):
+        """Set a gauge to a value
+
+        Arguments:
+        name -- Metric name (synack_poll_interval_seconds, etc.)
+        value -- Current value
+        help -- Description shown in the exporter
+        labels -- Label names and values of the series
+        """
+        with self._lock:
+            self.gauges.setdefault(name, dict())[tuple(sorted(labels.items()))] = value
+            if help:
+                self._help[name] = help
+
+    def observe(self, name, seconds, help=None, **labels):
+        """Add a duration to a histogram
+
+        Arguments:
+        name -- Metric name (synack_claim_latency_seconds, etc.)
+        seconds -- Duration to record
+        help -- Description shown in the exporter
+        labels -- Label names and values of the series
+        """
+        with self._lock:
+            self._observe(name, tuple(sorted(labels.items())), seconds)
+            if help:
+                self._help[name] = help
+
+    def _observe(self, name, key, seconds):
+        hist = self.histograms[name].get(key)
+        if hist is None:
+            hist = self.histograms[name][key] = [0] * (len(self.buckets) + 1) + [0.0]
+        hist[bisect.bisect_left(self.buckets, seconds)] += 1
+        hist[-1] += seconds
+
+    def observe_request(self, method, endpoint, status, seconds, size=0):
+        """Record one network request
+
+        Arguments:
+        method -- Request method verb
+        endpoint -- Normalized endpoint path (see Api.build_endpoint)
+        status -- Response status code, or 'error' if no response came back
+        seconds -- Time the request took
+        size -- Bytes in the response body
+        """
+        key = (('endpoint', endpoint), ('method', method))
+        with self._lock:
+            self.counters['synack_api_requests_total'][key + (('status', str(status)),)] += 1
+            self.counters['synack_api_response_bytes_total'][key] += size
+            self._observe('synack_api_request_seconds', key, seconds)
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        help = {
+            'synack_api_requests_total': 'Requests sent to the Synack APIs',
+            'synack_api_response_bytes_total': 'Response body bytes received from the Synack APIs',
+            'synack_api_request_seconds': 'Latency of requests to the Synack APIs',
+        }
+        lines = list()
+        with self._lock:
+            help.update(self._help)
+            for name, series in sorted(self.counters.items()):
+                lines.extend(self._render_header(name, 'counter', help))
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{self._render_labels(labels)} {value}')
+            for name, series in sorted(self.gauges.items()):
+                lines.extend(self._render_header(name, 'gauge', help))
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{self._render_labels(labels)} {value}')
+            for name, series in sorted(self.histograms.items()):
+                lines.extend(self._render_header(name, 'histogram', help))
+                for labels, hist in sorted(series.items()):
+                    total = 0
+                    for bound, count in zip(self.buckets + ('+Inf',), hist):
+                        total += count
+                        lines.append(f'{name}_bucket{self._render_labels(labels + (("le", str(bound)),))} {total}')
+                    lines.append(f'{name}_sum{self._render_labels(labels)} {hist[-1]}')
+                    lines.append(f'{name}_count{self._render_labels(labels)} {total}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_header(name, kind, help):
+        ret = list()
+        if name in help:
+            ret.append(f'# HELP {name} {help[name]}')
+        ret.append(f'# TYPE {name} {kind}')
+        return ret
+
+    @staticmethod
+    def _render_labels(labels):
+        if not labels:
+            return ''
+        pairs = list()
+        for key, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{key}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def serve(self, port=9100, addr='127.0.0.1'):
+        """Serve the metrics on http://addr:port/metrics from a background thread
+
+        Arguments:
+        port -- TCP port to listen on (0 picks a free one)
+        addr -- Address to bind to
+        """
+        if self.server is not None:
+            return self.server
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((addr, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='synack-metrics', daemon=True).start()
+        return self.server
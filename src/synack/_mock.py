@@ -0,0 +1,437 @@
+"""mock.py
+
+Local stand-in for the Synack APIs, for offline benchmarks and tests.
+
+    server = MockServer(missions=200, latency=0.05).start()
+    h = synack.Handler(login=False, **server.state_kwargs)
+
+or from a shell:
+
+    python -m synack._mock --port 8443 --missions 200 --latency 0.05
+"""
+
+import argparse
+import collections
+import email.utils
+import hashlib
+import http.server
+import json
+import random
+import re
+import socket
+import threading
+import time
+import urllib.parse
+import uuid
+
+from datetime import datetime, timedelta
+
+
+class MockServer:
+    """Threaded HTTP server answering the endpoints the plugins use
+
+    Every API is served from one address: the platform and login APIs under
+    /api/ and the notifications API under /api/v2/. The read-mostly
+    endpoints send ETag and Last-Modified validators and answer conditional
+    requests with a 304 while their body is unchanged.
+
+    Arguments:
+    host -- Address to bind to
+    port -- TCP port to listen on (0 picks a free one)
+    missions -- Number of published missions to generate
+    targets -- Number of registered targets to generate
+    assets -- Number of assets per target
+    hosts -- Number of Hydra results per target
+    claim_limit -- Mission wallet limit reported by profiles/me
+    hydra_page_size -- Results per page of hydra_search/search
+    max_page_size -- Largest perPage honoured by tasks/v2/tasks
+    latency -- Seconds to wait before answering each request
+    jitter -- Extra random delay in seconds, up to this much
+    error_rate -- Fraction of requests answered with error_status
+    error_status -- Status code of randomly injected errors
+    seed -- Seed of the generated data and injected errors
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, missions=50, targets=5, assets=100, hosts=25,
+                 claim_limit=1000, hydra_page_size=10, max_page_size=100, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_status=503, seed=0):
+        self.host = host
+        self.port = port
+        self.claim_limit = claim_limit
+        self.hydra_page_size = hydra_page_size
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = collections.Counter()
+        self.not_modified = collections.Counter()
+        self.server = None
+        self._faults = list()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._validators = dict()
+        # (method, path regex, handler, whether responses carry validators)
+        self._routes = [
+            ('GET', r'^launchpoint$', self.get_launchpoint, False),
+            ('PUT', r'^launchpoint$', self.set_launchpoint, False),
+            ('GET', r'^profiles/me$', self.get_profile, True),
+            ('GET', r'^assessments$', self.get_assessments, True),
+            ('GET', r'^targets$', self.get_targets, True),
+            ('GET', r'^targets/registered_summary$', self.get_targets, True),
+            ('GET', r'^asset/v2/assets$', self.get_assets, True),
+            ('GET', r'^hydra_search/search$', self.get_hydra, False),
+            ('HEAD', r'^tasks/v1/tasks$', self.get_count, False),
+            ('GET', r'^tasks/v2/tasks$', self.get_missions, False),
+            ('GET', r'^tasks/v2/researcher/claimed_amount$', self.get_claimed_amount, False),
+            ('POST', r'^tasks/v1/organizations/[^/]+/listings/[^/]+/campaigns/[^/]+/tasks/([^/]+)/transitions$',
+             self.set_transition, False),
+            ('GET', r'^v2/notifications$', self.get_notifications, False),
+            ('GET', r'^v2/notifications/unread_count$', self.get_unread_count, False),
+        ]
+        self._routes = [(m, re.compile(p), f, c) for m, p, f, c in self._routes]
+
+        self.connected = ''
+        self.targets = [self.build_target(i) for i in range(targets)]
+        self.missions = dict()
+        self.add_missions(missions)
+        self.assets = {t['slug']: [self.build_asset(t, i) for i in range(assets)] for t in self.targets}
+        self.hydra = {t['slug']: [self.build_hydra(t, i) for i in range(hosts)] for t in self.targets}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.server.server_address[1]}'
+
+    @property
+    def state_kwargs(self):
+        """Handler/State keyword arguments that point every API at this server"""
+        return {
+            'api_base': f'{self.url}/api/',
+            'login_base': f'{self.url}/api/',
+            'notifications_base': f'{self.url}/api/v2/',
+        }
+
+    def add_fault(self, endpoint, status=503, times=1, method=None, retry_after=None):
+        """Answer the next requests to an endpoint with an error
+
+        Arguments:
+        endpoint -- Regex matched against the path after /api/
+        status -- Status code to answer with
+        times -- Number of requests to fail
+        method -- Only fail requests with this verb
+        retry_after -- Value of the Retry-After header to send, if any
+        """
+        with self._lock:
+            self._faults.append([method, re.compile(endpoint), status, times, retry_after])
+
+    def add_missions(self, count, status='PUBLISHED'):
+        """Generate more missions, as if they were just published"""
+        with self._lock:
+            for _ in range(count):
+                mission = self.build_mission(self._random.choice(self.targets), status)
+                self.missions[mission['id']] = mission
+
+    def build_asset(self, target, i):
+        return {
+            'listings': [{'listingUid': target['slug'], 'scope': 'in'}],
+            'location': f'https://{i}.{target["codename"].lower()}.example.com',
+            'assetType': 'host',
+            'active': True,
+        }
+
+    def build_validators(self, raw_path, content):
+        """Return the ETag and Last-Modified of a response body
+
+        The ETag is derived from the body, and Last-Modified is the first
+        time this body was served for the path.
+        """
+        etag = f'"{hashlib.sha1(content).hexdigest()}"'
+        with self._lock:
+            validators = self._validators.get(raw_path)
+            if validators is None or validators[0] != etag:
+                validators = self._validators[raw_path] = (etag, email.utils.formatdate(usegmt=True))
+        return validators
+
+    def build_hydra(self, target, i):
+        port = str(self._random.choice([22, 80, 443, 8080, 8443]))
+        return {
+            'ip': f'10.{self._random.randrange(256)}.{i // 256}.{i % 256}',
+            'listing_uid': target['slug'],
+            'last_changed_dt': '2023-01-01T00:00:00Z',
+            'ports': {
+                port: {
+                    'tcp': {
+                        'nmap': {
+                            'open': {'parsed': True},
+                            'verified_service': {'parsed': 'http'},
+                            'product': {'parsed': 'nginx'},
+                        }
+                    }
+                }
+            }
+        }
+
+    def build_mission(self, target, status='PUBLISHED'):
+        now = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        return {
+            'id': str(uuid.UUID(int=self._random.getrandbits(128))),
+            'organizationUid': target['organization_id'],
+            'listingUid': target['slug'],
+            'listingCodename': target['codename'],
+            'campaignUid': uuid.UUID(int=self._random.getrandbits(128)).hex[:10],
+            'title': f'Mission {self._random.randrange(100000)}',
+            'status': status,
+            'payout': {'amount': self._random.choice([10, 25, 50, 75, 100, 150, 200]), 'currency': 'USD'},
+            'assetTypes': ['host'],
+            'taskType': 'MISSION',
+            'validResponses': [{'label': 'Yes', 'value': 'yes'}, {'label': 'No', 'value': 'no'}],
+            'maxCompletionTimeInSecs': 86400,
+            'claimedOn': now,
+            'modifiedOn': now,
+        }
+
+    def build_target(self, i):
+        slug = uuid.UUID(int=self._random.getrandbits(128)).hex[:10]
+        return {
+            'id': slug,
+            'slug': slug,
+            'codename': f'MOCK{i}',
+            'name': f'Mock target {i}',
+            'organization_id': uuid.UUID(int=self._random.getrandbits(128)).hex[:10],
+            'category': {'id': 1, 'name': 'Web Application'},
+            'activated_at': int((datetime.utcnow() - timedelta(days=i)).timestamp()),
+            'collaboration_criteria': None,
+        }
+
+    def get_assessments(self, query, body):
+        return 200, [{
+            'category_id': 1,
+            'category_name': 'Web Application',
+            'practical_assessment': {'passed': True},
+            'written_assessment': {'passed': True},
+        }]
+
+    def get_assets(self, query, body):
+        listing = query.get('listingUid[]', [None])[0]
+        assets = self.assets.get(listing, [])
+        page, per_page = self.get_page(query, 5000)
+        return 200, assets[(page - 1) * per_page:page * per_page]
+
+    def get_claimed_amount(self, query, body):
+        with self._lock:
+            claimed = sum(m['payout']['amount'] for m in self.missions.values() if m['status'] == 'CLAIMED')
+        return 200, {'claimedAmount': claimed}
+
+    def get_count(self, query, body):
+        status = query.get('status', ['PUBLISHED'])[0]
+        with self._lock:
+            count = sum(1 for m in self.missions.values() if m['status'] == status)
+        return 204, None, {'x-count': str(count)}
+
+    def get_hydra(self, query, body):
+        listing = query.get('listing_uids', [None])[0]
+        page, size = self.get_page(query)
+        return 200, self.hydra.get(listing, [])[(page - 1) * size:page * size]
+
+    def get_launchpoint(self, query, body):
+        return 200, {'slug': self.connected}
+
+    def get_missions(self, query, body):
+        status = query.get('status', ['PUBLISHED'])[0]
+        listings = query.get('listingUids')
+        page, per_page = self.get_page(query, min(20, self.max_page_size), self.max_page_size)
+        with self._lock:
+            missions = [dict(m) for m in self.missions.values()
+                        if m['status'] == status and (not listings or m['listingUid'] in listings)]
+        return 200, missions[(page - 1) * per_page:page * per_page]
+
+    def get_notifications(self, query, body):
+        return 200, [{'id': 1, 'subject': 'Mock notification', 'read': False}]
+
+    def get_page(self, query, default_size=None, max_size=None):
+        """Return the page number and page size a request asks for
+
+        Without a default_size the page size is fixed to hydra_page_size.
+        """
+        if default_size is None:
+            default_size = max_size = self.hydra_page_size
+        try:
+            page = max(1, int(query.get('page', [1])[0]))
+            size = max(1, int(query.get('perPage', [default_size])[0]))
+        except ValueError:
+            page, size = 1, default_size
+        return page, min(size, max_size) if max_size else size
+
+    def get_profile(self, query, body):
+        return 200, {'user_id': 'mockuser', 'claim_limit': self.claim_limit}
+
+    def get_targets(self, query, body):
+        return 200, self.targets
+
+    def get_unread_count(self, query, body):
+        return 200, {'unread_count': 1}
+
+    def set_launchpoint(self, query, body):
+        self.connected = query.get('listing_id', [''])[0]
+        return 200, {}
+
+    def set_transition(self, query, body, mission_id):
+        kind = (body or {}).get('type')
+        with self._lock:
+            mission = self.missions.get(mission_id)
+            if mission is None:
+                return 404, {'message': 'Task not found'}
+            if kind == 'CLAIM' and mission['status'] == 'PUBLISHED':
+                claimed = sum(m['payout']['amount'] for m in self.missions.values() if m['status'] == 'CLAIMED')
+                if claimed + mission['payout']['amount'] > self.claim_limit:
+                    return 412, {'message': 'Mission wallet limit reached'}
+                mission['status'] = 'CLAIMED'
+                mission['claimedOn'] = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+                return 201, {}
+            if kind == 'DISCLAIM' and mission['status'] == 'CLAIMED':
+                mission['status'] = 'PUBLISHED'
+                return 201, {}
+        return 412, {'message': f'Cannot {kind} a {mission["status"]} task'}
+
+    def handle(self, method, raw_path, body, request_headers=None):
+        """Return the (status, headers, body bytes) answering a request"""
+        url = urllib.parse.urlsplit(raw_path)
+        path = url.path.strip('/')
+        if path.startswith('api/'):
+            path = path[4:]
+        query = urllib.parse.parse_qs(url.query)
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        with self._lock:
+            self.requests[f'{method} {path}'] += 1
+            for fault in self._faults:
+                if fault[3] > 0 and (fault[0] is None or fault[0] == method) and fault[1].search(path):
+                    fault[3] -= 1
+                    headers = {'Retry-After': str(fault[4])} if fault[4] is not None else {}
+                    return fault[2], headers, b''
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.error_status, {}, b''
+
+        for route_method, pattern, func, validated in self._routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                ret = func(query, body, *match.groups())
+                status, data = ret[:2]
+                headers = {'Content-Type': 'application/json', **(ret[2] if len(ret) > 2 else {})}
+                content = json.dumps(data).encode() if data is not None else b''
+                if validated and status == 200:
+                    etag, last_modified = self.build_validators(raw_path, content)
+                    headers.update({'ETag': etag, 'Last-Modified': last_modified})
+                    if self.is_not_modified(request_headers or {}, etag, last_modified):
+                        with self._lock:
+                            self.not_modified[f'{method} {path}'] += 1
+                        return 304, {'ETag': etag, 'Last-Modified': last_modified}, b''
+                return status, headers, content
+        return 404, {'Content-Type': 'application/json'}, b'{"message": "Not found"}'
+
+    @staticmethod
+    def is_not_modified(request_headers, etag, last_modified):
+        """Return whether the conditional headers of a request match the current validators
+
+        If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+        """
+        if_none_match = request_headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        if_modified_since = request_headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return email.utils.parsedate_to_datetime(last_modified) <= since
+        return False
+
+    def start(self):
+        """Start serving from a background thread and return self"""
+        mock = self
+
+        class MockHandler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                # Headers and body are written separately; without this,
+                # Nagle's algorithm delays every response by a delayed ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(body) if body else None
+                except ValueError:
+                    body = None
+                status, headers, content = mock.handle(self.command, self.path, body, self.headers)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                if status != 304:
+                    self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                if self.command != 'HEAD' and status != 304:
+                    self.wfile.write(content)
+
+            do_DELETE = do_GET = do_HEAD = do_PATCH = do_POST = do_PUT = do_request
+
+            def log_message(self, *args):
+                pass
+
+        server_class = type('MockHTTPServer', (http.server.ThreadingHTTPServer,), {'request_queue_size': 128})
+        self.server = server_class((self.host, self.port), MockHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='synack-mock', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the Synack APIs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--missions', type=int, default=50)
+    parser.add_argument('--targets', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--hydra-page-size', type=int, default=10)
+    parser.add_argument('--max-page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    server = MockServer(host=args.host, port=args.port, missions=args.missions, targets=args.targets,
+                        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        error_status=args.error_status, hydra_page_size=args.hydra_page_size,
+                        max_page_size=args.max_page_size).start()
+    print(f'Serving the Synack APIs on {server.url}')
+    for key, value in server.state_kwargs.items():
+        print(f'\t{key}={value}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""poll.py
+
+Adaptive, jittered polling intervals for mission detection.
+"""
+
+import collections
+import random
+import threading
+import time
+
+
+class PollScheduler:
+    """Decide how long to wait between two polls
+
+    Polling is tight (min_interval) while missions were published recently,
+    then backs off geometrically up to max_interval once things are quiet.
+    Failed polls (rate limited, server errors) back off twice as fast. No
+    more than `budget` polls are made in any 60 second window.
+
+    Arguments:
+    min_interval -- Shortest wait in seconds, used right after activity
+    max_interval -- Longest wait in seconds, used when idle
+    hot_period -- Seconds after activity during which polling stays tight
+    backoff -- Factor the interval grows by after every idle poll
+    jitter -- Random fraction (+/-) added to every interval
+    budget -- Most polls allowed per minute, or None for no limit
+    metrics -- Metrics to report the interval and detection lag to
+    """
+
+    def __init__(self, min_interval=0.5, max_interval=10, hot_period=60, backoff=1.5, jitter=0.2,
+                 budget=90, metrics=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.hot_period = hot_period
+        self.backoff = backoff
+        self.jitter = jitter
+        self.budget = budget
+        self.metrics = metrics
+        self.interval = max_interval
+        self.lag = None
+        self._active_at = None
+        self._polled_at = None
+        self._polls = collections.deque()
+        self._lock = threading.Lock()
+
+    def get_interval(self):
+        """Return the number of seconds to wait before the next poll"""
+        with self._lock:
+            delay = self.interval
+            if self.jitter:
+                delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            if self.budget and len(self._polls) >= self.budget:
+                delay = max(delay, self._polls[-self.budget] + 60 - time.monotonic())
+            delay = max(0.0, delay)
+        if self.metrics is not None:
+            self.metrics.gauge('synack_poll_interval_seconds', delay,
+                               help='Seconds until the next mission availability poll')
+        return delay
+
+    def set_polled(self, found=False, failed=False, at=None):
+        """Record the result of a poll and adapt the interval
+
+        Arguments:
+        found -- Whether new missions were detected
+        failed -- Whether the poll failed or was rate limited
+        at -- time.monotonic() value of when the poll was answered
+              (defaults to now), so work done after it is not counted
+        """
+        now = time.monotonic() if at is None else at
+        with self._lock:
+            self._polls.append(now)
+            while self._polls and self._polls[0] <= now - 60:
+                self._polls.popleft()
+            if found:
+                self._active_at = now
+                self.interval = self.min_interval
+                if self._polled_at is not None:
+                    # Missions went up at some point since the previous poll
+                    self.lag = now - self._polled_at
+            elif failed:
+                self.interval = min(self.max_interval, max(self.min_interval, self.interval) * self.backoff ** 2)
+            elif self._active_at is not None and now - self._active_at < self.hot_period:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.max_interval, max(self.min_interval, self.interval) * self.backoff)
+            self._polled_at = now
+            lag = self.lag if found else None
+        if lag is not None and self.metrics is not None:
+            self.metrics.gauge('synack_poll_detection_lag_seconds', lag,
+                               help='Longest time newly published missions may have gone unnoticed')
@@ -0,0 +1,42 @@
+"""pool.py
+
+Connection pooling for the HTTP session shared by every plugin.
+"""
+
+import socket
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+SYNACK_HOSTS = [
+    'platform.synack.com',
+    'login.synack.com',
+    'notifications.synack.com',
+]
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter that enables TCP keep-alive on its pooled connections
+
+    Idle connections are probed instead of silently dropped by middleboxes,
+    so the next request can reuse them without a new TLS handshake.
+    """
+
+    def __init__(self, keep_alive=None, **kwargs):
+        self.keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keep_alive:
+            kwargs['socket_options'] = self.build_socket_options(self.keep_alive)
+        super().init_poolmanager(*args, **kwargs)
+
+    @staticmethod
+    def build_socket_options(keep_alive):
+        options = list(HTTPConnection.default_socket_options)
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, int(keep_alive)))
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, int(keep_alive) // 4)))
+        return options
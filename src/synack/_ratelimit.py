@@ -0,0 +1,176 @@
+"""ratelimit.py
+
+Token-bucket rate limiting of the requests made to the Synack APIs.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+
+RATE_LIMIT_HOSTS = {
+    'platform.synack.com': (10, 20),
+    'login.synack.com': (2, 5),
+    'notifications.synack.com': (2, 5),
+}
+
+RATE_LIMIT_CLASSES = [
+    ('claim', 'POST', r'^tasks/v1/organizations/.+/transitions$', 5, 10, True),
+    ('poll', 'HEAD', r'^tasks/v1/tasks$', 4, 8, True, {'status': 'PUBLISHED'}),
+    ('poll', 'GET', r'^tasks/v2/tasks$', 4, 8, True, {'status': 'PUBLISHED'}),
+    ('scrape', 'GET', r'^(tasks/v2/tasks|hydra_search/search|asset/v2/assets|listing_analytics/.+|targets(/.*)?)$',
+     2, 5, False),
+]
+
+
+class RateLimiter:
+    """Token buckets shared by every request to a host and by classes of endpoints
+
+    A request takes one token from the bucket of its host and one from the
+    bucket of the first endpoint class it matches. Requests outside of the
+    priority classes must leave `reserve` tokens in the host bucket, so
+    background scraping can never use up the budget that mission detection
+    and claims need.
+
+    Arguments:
+    hosts -- Dictionary of host: (requests per second, burst)
+    classes -- List of (name, method, endpoint regex, requests per second,
+               burst, priority[, query]) tuples; method None matches every
+               verb, and query is a dictionary of parameter: regex the query
+               string must also match. Classes with the same name share a
+               bucket.
+    reserve -- Host tokens only priority classes may use
+    path -- SQLite file to keep the buckets in, so several processes share
+            them, or None to keep them in memory
+    """
+
+    def __init__(self, hosts=None, classes=None, reserve=5, path=None):
+        self.hosts = dict(RATE_LIMIT_HOSTS if hosts is None else hosts)
+        if classes is None:
+            classes = RATE_LIMIT_CLASSES
+        self.classes = [(n, m.upper() if m else None, re.compile(p), r, b, pr,
+                         {k: re.compile(v) for k, v in (q[0] if q else {}).items()})
+                        for n, m, p, r, b, pr, *q in classes]
+        self.reserve = reserve
+        self.path = path
+        self.waits = 0
+        self._buckets = dict()
+        self._clock = time.time if path else time.monotonic
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if path:
+            with self._connect() as conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                             '(name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def acquire(self, method, host, endpoint, query=None):
+        """Wait until a request may be sent and return the seconds waited
+
+        Arguments:
+        method -- Request method verb
+        host -- Host name the request goes to
+        endpoint -- Normalized endpoint path (see Api.build_endpoint)
+        query -- Query string dictionary of the request
+        """
+        waited = 0.0
+        while True:
+            delay = self.take(method, host, endpoint, query)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def get_buckets(self, method, host, endpoint, query=None):
+        """Return the (name, rate, burst, floor) of the buckets a request draws from
+
+        Arguments:
+        method -- Request method verb
+        host -- Host name the request goes to
+        endpoint -- Normalized endpoint path (see Api.build_endpoint)
+        query -- Query string dictionary of the request
+        """
+        priority = False
+        ret = list()
+        for name, class_method, pattern, rate, burst, is_priority, class_query in self.classes:
+            if (class_method is None or class_method == method) and pattern.search(endpoint) and \
+                    self._match_query(class_query, query):
+                ret.append((f'class:{name}', rate, burst, 0))
+                priority = is_priority
+                break
+        if host in self.hosts:
+            rate, burst = self.hosts[host]
+            ret.append((f'host:{host}', rate, burst, 0 if priority else min(self.reserve, burst - 1)))
+        return ret
+
+    def take(self, method, host, endpoint, query=None):
+        """Take the tokens for a request if they are all there
+
+        Returns 0 when the request may be sent, or how many seconds to wait
+        before trying again. Nothing is taken in that case.
+
+        Arguments:
+        method -- Request method verb
+        host -- Host name the request goes to
+        endpoint -- Normalized endpoint path (see Api.build_endpoint)
+        query -- Query string dictionary of the request
+        """
+        buckets = self.get_buckets(method, host, endpoint, query)
+        if not buckets:
+            return 0
+        if self.path:
+            return self._take_shared(buckets)
+        with self._lock:
+            states = {name: self._buckets.get(name) for name, _, _, _ in buckets}
+            delay = self._take(buckets, states)
+            self._buckets.update(states)
+        return delay
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _match_query(class_query, query):
+        for key, pattern in class_query.items():
+            value = (query or {}).get(key)
+            if value is None or not pattern.fullmatch(str(value)):
+                return False
+        return True
+
+    def _take(self, buckets, states):
+        now = self._clock()
+        delay = 0.0
+        for name, rate, burst, floor in buckets:
+            tokens, updated = states[name] or (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            states[name] = (tokens, now)
+            if tokens < floor + 1:
+                delay = max(delay, (floor + 1 - tokens) / rate)
+        if delay:
+            self.waits += 1
+            return delay
+        for name, _, _, _ in buckets:
+            tokens, updated = states[name]
+            states[name] = (tokens - 1, updated)
+        return 0
+
+    def _take_shared(self, buckets):
+        conn = self._connect()
+        names = [name for name, _, _, _ in buckets]
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(f'SELECT name, tokens, updated FROM buckets WHERE name IN '
+                                f'({",".join("?" * len(names))})', names).fetchall()
+            states = dict.fromkeys(names)
+            states.update({name: (tokens, updated) for name, tokens, updated in rows})
+            delay = self._take(buckets, states)
+            conn.executemany('INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                             [(name, tokens, updated) for name, (tokens, updated) in states.items()])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return delay
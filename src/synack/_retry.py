@@ -0,0 +1,125 @@
+"""retry.py
+
+Defines when and how failed API requests are retried.
+"""
+
+import email.utils
+import random
+import re
+import requests
+import sys
+import time
+
+IDEMPOTENT_METHODS = ('DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT')
+
+
+class RetryPolicy:
+    """Jittered exponential backoff with per-endpoint idempotency rules
+
+    Arguments:
+    retries -- Retries for idempotent requests without a more specific rule
+    backoff -- Base delay in seconds, doubled on every attempt
+    backoff_max -- Longest delay in seconds between two attempts
+    retry_after_max -- Longest Retry-After in seconds worth waiting for
+                       Responses asking for a longer wait are returned as-is
+    statuses -- Response codes that are worth retrying
+    rules -- List of (method, endpoint regex, retries) tuples
+             The first matching rule wins over the defaults
+    """
+
+    def __init__(self, retries=3, backoff=0.25, backoff_max=8, retry_after_max=30,
+                 statuses=(429, 500, 502, 503, 504), rules=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.statuses = set(statuses)
+        if rules is None:
+            rules = [
+                ('HEAD', r'^tasks/v1/tasks$', 1),
+                ('POST', r'/transitions$', 0),
+            ]
+        self.rules = [(m.upper(), re.compile(p), r) for m, p, r in rules]
+
+    def get_retries(self, method, endpoint):
+        """Return how many times a request may be retried
+
+        Arguments:
+        method -- Request method verb
+        endpoint -- Normalized endpoint path (see Api.build_endpoint)
+        """
+        for rule_method, pattern, retries in self.rules:
+            if rule_method == method and pattern.search(endpoint):
+                return retries
+        return self.retries if method in IDEMPOTENT_METHODS else 0
+
+    def get_retry_after(self, res):
+        """Return the delay in seconds requested by a Retry-After header, if any"""
+        value = res.headers.get('Retry-After') if res is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def allows(self, method, endpoint, attempt, res=None, exc=None):
+        """Return whether a failed request should be attempted again
+
+        Arguments:
+        method -- Request method verb
+        endpoint -- Normalized endpoint path (see Api.build_endpoint)
+        attempt -- Number of retries already made
+        res -- Response to the last attempt, if any
+        exc -- Exception raised by the last attempt, if any
+        """
+        if exc is None and not self.is_retryable(res):
+            return False
+        retries = self.get_retries(method, endpoint)
+        if retries == 0 and self.is_unsent(res, exc):
+            retries = self.retries
+        return attempt < retries
+
+    def get_delay(self, attempt, res=None):
+        """Return how long to wait before the next attempt
+
+        Arguments:
+        attempt -- Number of retries already made
+        res -- Response that triggered the retry, if any
+        """
+        retry_after = self.get_retry_after(res)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def is_retryable(self, res):
+        """Return whether a response is worth retrying
+
+        Arguments:
+        res -- Response to the last attempt
+        """
+        if res.status_code not in self.statuses:
+            return False
+        retry_after = self.get_retry_after(res)
+        return retry_after is None or retry_after <= self.retry_after_max
+
+    def is_unsent(self, res=None, exc=None):
+        """Return whether a failed request provably had no effect on the server
+
+        Such requests are safe to retry even when they are not idempotent.
+
+        Arguments:
+        res -- Response to the last attempt, if any
+        exc -- Exception raised by the last attempt, if any
+        """
+        if exc is not None:
+            if isinstance(exc, requests.exceptions.ConnectTimeout):
+                return True
+            # Only loaded once AsyncApi has been used
+            aiohttp = sys.modules.get('aiohttp')
+            return aiohttp is not None and isinstance(exc, aiohttp.ClientConnectorError)
+        return res.status_code == 429
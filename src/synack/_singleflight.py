@@ -0,0 +1,118 @@
+"""singleflight.py
+
+Coalesces identical in-flight requests into a single call.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Share the result of a call between threads asking for the same key
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for it and receive the same result (or exception).
+
+    Arguments:
+    copy -- Function giving every waiting caller its own copy of the result
+
+    Attributes:
+    hits -- Number of calls made through do()
+    merges -- Number of those calls answered by another caller's request
+    """
+
+    def __init__(self, copy=None):
+        self.copy = copy
+        self.hits = 0
+        self.merges = 0
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Run func() for a key unless a call for the same key is in flight
+
+        Arguments:
+        key -- Hashable identity of the call
+        func -- Function to run when no identical call is in flight
+        """
+        with self._lock:
+            self.hits += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.merges += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return self.copy(call.result) if self.copy else call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Share the result of a coroutine between tasks asking for the same key
+
+    Arguments:
+    copy -- Function giving every waiting task its own copy of the result
+
+    Attributes:
+    hits -- Number of calls made through do()
+    merges -- Number of those calls answered by another task's request
+    """
+
+    def __init__(self, copy=None):
+        self.copy = copy
+        self.hits = 0
+        self.merges = 0
+        self._calls = dict()
+
+    async def do(self, key, func):
+        """Await func() for a key unless a call for the same key is in flight
+
+        Arguments:
+        key -- Hashable identity of the call
+        func -- Coroutine function to run when no identical call is in flight
+        """
+        self.hits += 1
+        future = self._calls.get(key)
+        if future is not None:
+            self.merges += 1
+            result = await asyncio.shield(future)
+            return self.copy(result) if self.copy else result
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            self._calls.pop(key, None)
+        return result
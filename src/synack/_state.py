@@ -5,28 +5,96 @@ Defines the handler class and generally sets up the project.
 
 import pathlib
 import requests
-
+import threading
+
+from ._cache import CACHE_ENDPOINTS
+from ._cache import ResponseCache
+from ._metrics import Metrics
+from ._pool import KeepAliveAdapter
+from ._pool import SYNACK_HOSTS
+from ._ratelimit import RateLimiter
+from ._retry import RetryPolicy
 from typing import Union
+from urllib.parse import urlparse
 
 
 class State(object):
     def __init__(self):
+        self._api_base = 'https://platform.synack.com/api/'
+        self._cache_endpoints = list(CACHE_ENDPOINTS)
+        self._cache_max_bytes = 64 * 1024 * 1024
+        self._cache_persist = False
+        self._claim_workers = 8
         self._config_dir = None
+        self._connected_ttl = 10
         self._debug = None
+        self._debug_body_limit = 2048
+        self._debug_log_file = None
+        self._debug_sample_rate = 1.0
+        self._download_workers = 4
         self._email = None
         self._http_proxy = None
+        self._keep_alive = 60
+        self._keep_warm_connections = 4
+        self._keep_warm_interval = 20
         self._https_proxy = None
         self._login = None
+        self._login_base = 'https://login.synack.com/api/'
+        self._metrics = None
+        self._metrics_port = None
+        self._notifications_base = 'https://notifications.synack.com/api/v2/'
         self._notifications_token = None
         self._otp_secret = None
+        self._page_workers = 4
         self._password = None
+        self._pool_block = False
+        self._pool_maxsize = 20
+        self._pool_sizes = dict()
         self._proxies = None
+        self._rate_limit_shared = False
+        self._rate_limiter = None
+        self._response_cache = None
+        self._retry_policy = None
         self._session = None
+        self._session_hosts = set()
+        self._session_lock = threading.Lock()
         self._template_dir = None
+        self._token_refresh_margin = 300
         self._scratchspace_dir = None
+        self._use_metrics = True
+        self._use_prepared_claims = True
         self._use_proxies = None
+        self._use_rate_limiter = True
+        self._use_response_cache = True
         self._use_scratchspace = None
+        self._use_single_flight = True
+        self._use_token_refresh = True
         self._user_id = None
+        self._wallet_ttl = 60
+
+    @property
+    def api_base(self) -> str:
+        return self._api_base
+
+    @api_base.setter
+    def api_base(self, value: str) -> None:
+        self._api_base = value.rstrip('/') + '/'
+
+    @property
+    def login_base(self) -> str:
+        return self._login_base
+
+    @login_base.setter
+    def login_base(self, value: str) -> None:
+        self._login_base = value.rstrip('/') + '/'
+
+    @property
+    def notifications_base(self) -> str:
+        return self._notifications_base
+
+    @notifications_base.setter
+    def notifications_base(self, value: str) -> None:
+        self._notifications_base = value.rstrip('/') + '/'
 
     @property
     def config_dir(self) -> pathlib.PosixPath:
@@ -42,6 +110,71 @@ class State(object):
             value = pathlib.Path(value).expanduser().resolve()
         self._config_dir = value
 
+    @property
+    def cache_endpoints(self) -> list():
+        return self._cache_endpoints
+
+    @cache_endpoints.setter
+    def cache_endpoints(self, value: list) -> None:
+        self._cache_endpoints = value
+
+    @property
+    def cache_max_bytes(self) -> int:
+        return self._cache_max_bytes
+
+    @cache_max_bytes.setter
+    def cache_max_bytes(self, value: int) -> None:
+        self._cache_max_bytes = value
+        self._response_cache = None
+
+    @property
+    def cache_persist(self) -> bool:
+        return self._cache_persist
+
+    @cache_persist.setter
+    def cache_persist(self, value: bool) -> None:
+        self._cache_persist = value
+        self._response_cache = None
+
+    @property
+    def response_cache(self) -> ResponseCache:
+        if self._response_cache is None and self.use_response_cache:
+            path = self.config_dir / 'http_cache' if self.cache_persist else None
+            self._response_cache = ResponseCache(self.cache_max_bytes, path)
+        return self._response_cache if self.use_response_cache else None
+
+    @property
+    def use_response_cache(self) -> bool:
+        return self._use_response_cache
+
+    @use_response_cache.setter
+    def use_response_cache(self, value: bool) -> None:
+        self._use_response_cache = value
+
+    @property
+    def claim_workers(self) -> int:
+        return self._claim_workers
+
+    @claim_workers.setter
+    def claim_workers(self, value: int) -> None:
+        self._claim_workers = value
+
+    @property
+    def connected_ttl(self) -> float:
+        return self._connected_ttl
+
+    @connected_ttl.setter
+    def connected_ttl(self, value: float) -> None:
+        self._connected_ttl = value
+
+    @property
+    def token_refresh_margin(self) -> float:
+        return self._token_refresh_margin
+
+    @token_refresh_margin.setter
+    def token_refresh_margin(self, value: float) -> None:
+        self._token_refresh_margin = value
+
     @property
     def template_dir(self) -> pathlib.PosixPath:
         ret = self._template_dir
@@ -76,12 +209,172 @@ class State(object):
     def debug(self, value: bool) -> None:
         self._debug = value
 
+    @property
+    def debug_body_limit(self) -> int:
+        return self._debug_body_limit
+
+    @debug_body_limit.setter
+    def debug_body_limit(self, value: int) -> None:
+        self._debug_body_limit = value
+
+    @property
+    def debug_log_file(self) -> pathlib.PosixPath:
+        return self._debug_log_file
+
+    @debug_log_file.setter
+    def debug_log_file(self, value: Union[str, pathlib.PosixPath]) -> None:
+        if type(value) == str:
+            value = pathlib.Path(value).expanduser().resolve()
+        self._debug_log_file = value
+
+    @property
+    def debug_sample_rate(self) -> float:
+        return self._debug_sample_rate
+
+    @debug_sample_rate.setter
+    def debug_sample_rate(self, value: float) -> None:
+        self._debug_sample_rate = value
+
+    @property
+    def download_workers(self) -> int:
+        return self._download_workers
+
+    @download_workers.setter
+    def download_workers(self, value: int) -> None:
+        self._download_workers = value
+
+    @property
+    def page_workers(self) -> int:
+        return self._page_workers
+
+    @page_workers.setter
+    def page_workers(self, value: int) -> None:
+        self._page_workers = value
+
     @property
     def session(self):
         if not self._session:
-            self._session = requests.Session()
+            with self._session_lock:
+                if not self._session:
+                    session = requests.Session()
+                    self._session_hosts = set()
+                    for host in SYNACK_HOSTS:
+                        self._mount_host(session, host)
+                    self._session = session
         return self._session
 
+    def build_session(self):
+        """Return a new session, with its own cookies, using the shared connection pools
+
+        For flows like logging in that must not leak cookies into the shared
+        session but should still reuse its tuned, kept-alive connections.
+        """
+        session = requests.Session()
+        for prefix, adapter in self.session.adapters.items():
+            session.mount(prefix, adapter)
+        return session
+
+    def mount_host(self, url):
+        """Give a host its own tuned connection pool on the shared session
+
+        The Synack hosts are mounted when the session is created. Other hosts
+        (Duo, Discord webhooks, etc.) are mounted the first time they are used.
+
+        Arguments:
+        url -- Full URL or bare hostname
+        """
+        host = urlparse(url).hostname if '://' in url else url
+        session = self.session
+        if host and host not in self._session_hosts:
+            with self._session_lock:
+                if host not in self._session_hosts:
+                    self._mount_host(session, host)
+        return session
+
+    def _mount_host(self, session, host):
+        pool_maxsize = self.pool_sizes.get(host, self.pool_maxsize)
+        adapter = KeepAliveAdapter(keep_alive=self.keep_alive,
+                                   pool_connections=1,
+                                   pool_maxsize=pool_maxsize,
+                                   pool_block=self.pool_block)
+        session.mount(f'https://{host}', adapter)
+        session.mount(f'http://{host}', adapter)
+        self._session_hosts.add(host)
+
+    @property
+    def keep_alive(self) -> int:
+        return self._keep_alive
+
+    @keep_alive.setter
+    def keep_alive(self, value: int) -> None:
+        self._keep_alive = value
+        self._session = None
+
+    @property
+    def keep_warm_connections(self) -> int:
+        return self._keep_warm_connections
+
+    @keep_warm_connections.setter
+    def keep_warm_connections(self, value: int) -> None:
+        self._keep_warm_connections = value
+
+    @property
+    def keep_warm_interval(self) -> float:
+        return self._keep_warm_interval
+
+    @keep_warm_interval.setter
+    def keep_warm_interval(self, value: float) -> None:
+        self._keep_warm_interval = value
+
+    @property
+    def pool_block(self) -> bool:
+        return self._pool_block
+
+    @pool_block.setter
+    def pool_block(self, value: bool) -> None:
+        self._pool_block = value
+        self._session = None
+
+    @property
+    def pool_maxsize(self) -> int:
+        return self._pool_maxsize
+
+    @pool_maxsize.setter
+    def pool_maxsize(self, value: int) -> None:
+        self._pool_maxsize = value
+        self._session = None
+
+    @property
+    def pool_sizes(self) -> dict():
+        return self._pool_sizes
+
+    @pool_sizes.setter
+    def pool_sizes(self, value: dict) -> None:
+        self._pool_sizes = value
+        self._session = None
+
+    @property
+    def metrics(self) -> Metrics:
+        if self._metrics is None and self.use_metrics:
+            self._metrics = Metrics()
+        return self._metrics if self.use_metrics else None
+
+    @property
+    def metrics_port(self) -> int:
+        return self._metrics_port
+
+    @metrics_port.setter
+    def metrics_port(self, value: int) -> None:
+        self._metrics_port = value
+
+    @property
+    def use_metrics(self) -> bool:
+        return self._use_metrics
+
+    @use_metrics.setter
+    def use_metrics(self, value: bool) -> None:
+        self._use_metrics = value
+
     @property
     def login(self) -> bool:
         return self._login
@@ -90,6 +383,14 @@ class State(object):
     def login(self, value: bool) -> None:
         self._login = value
 
+    @property
+    def use_prepared_claims(self) -> bool:
+        return self._use_prepared_claims
+
+    @use_prepared_claims.setter
+    def use_prepared_claims(self, value: bool) -> None:
+        self._use_prepared_claims = value
+
     @property
     def use_proxies(self) -> bool:
         return self._use_proxies
@@ -106,6 +407,22 @@ class State(object):
     def use_scratchspace(self, value: bool) -> None:
         self._use_scratchspace = value
 
+    @property
+    def use_single_flight(self) -> bool:
+        return self._use_single_flight
+
+    @use_single_flight.setter
+    def use_single_flight(self, value: bool) -> None:
+        self._use_single_flight = value
+
+    @property
+    def use_token_refresh(self) -> bool:
+        return self._use_token_refresh
+
+    @use_token_refresh.setter
+    def use_token_refresh(self, value: bool) -> None:
+        self._use_token_refresh = value
+
     @property
     def http_proxy(self) -> str:
         return self._http_proxy
@@ -129,6 +446,44 @@ class State(object):
             'https': self.https_proxy
         }
 
+    @property
+    def rate_limit_shared(self) -> bool:
+        return self._rate_limit_shared
+
+    @rate_limit_shared.setter
+    def rate_limit_shared(self, value: bool) -> None:
+        self._rate_limit_shared = value
+        self._rate_limiter = None
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        if self._rate_limiter is None and self.use_rate_limiter:
+            path = self.config_dir / 'ratelimit.db' if self.rate_limit_shared else None
+            self._rate_limiter = RateLimiter(path=path)
+        return self._rate_limiter if self.use_rate_limiter else None
+
+    @rate_limiter.setter
+    def rate_limiter(self, value: RateLimiter) -> None:
+        self._rate_limiter = value
+
+    @property
+    def use_rate_limiter(self) -> bool:
+        return self._use_rate_limiter
+
+    @use_rate_limiter.setter
+    def use_rate_limiter(self, value: bool) -> None:
+        self._use_rate_limiter = value
+
+    @property
+    def retry_policy(self) -> RetryPolicy:
+        if self._retry_policy is None:
+            self._retry_policy = RetryPolicy()
+        return self._retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, value: RetryPolicy) -> None:
+        self._retry_policy = value
+
     @property
     def otp_secret(self) -> str:
         return self._otp_secret
@@ -160,3 +515,11 @@ class State(object):
     @user_id.setter
     def user_id(self, value: str) -> None:
         self._user_id = value
+
+    @property
+    def wallet_ttl(self) -> float:
+        return self._wallet_ttl
+
+    @wallet_ttl.setter
+    def wallet_ttl(self, value: float) -> None:
+        self._wallet_ttl = value
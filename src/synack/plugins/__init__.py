@@ -2,6 +2,7 @@
 
 from .alerts import Alerts
 from .api import Api
+from .asyncapi import AsyncApi
 from .auth import Auth
 from .db import Db
 from .debug import Debug
@@ -3,25 +3,20 @@
 Functions to handle sending alerts to various clients
 """
 
-import email
 import datetime
 import json
 import re
-import requests
-import smtplib
 
 from .base import Plugin
 
 
 class Alerts(Plugin):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        for plugin in ['Db']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+    dependencies = ['Db']
 
     def email(self, subject='Test Alert', message='This is a test'):
+        import email.message
+        import smtplib
+
         message += f'\nTime: {datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}'
         msg = email.message.EmailMessage()
         msg.set_content(message)
@@ -64,8 +59,9 @@ class Alerts(Plugin):
         elif type == 'INFO':
             payload = {"embeds": [{ "title": "INFO", "color": 3066993,"description": f"{message}\n"}], "username": "mBOT","avatar_url":"https://i.imgur.com/4M34hi2.png" }
         else:
-            ayload = {"embeds": [{ "title": "WARN", "color": 15844367,"description": f"{message}\n"}], "username": "mBOT","avatar_url":"https://i.imgur.com/4M34hi2.png" }
+            payload = {"embeds": [{ "title": "WARN", "color": 15844367,"description": f"{message}\n"}], "username": "mBOT","avatar_url":"https://i.imgur.com/4M34hi2.png" }
         
-        requests.post(self.db.discord_webhook_url,
-                      data=json.dumps(payload),
-                      headers={'Content-Type': 'application/json'})
+        url = self.db.discord_webhook_url
+        self.state.mount_host(url).post(url,
+                                        data=json.dumps(payload),
+                                        headers={'Content-Type': 'application/json'})
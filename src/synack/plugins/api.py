@@ -3,16 +3,117 @@
 Functions to handle interacting with the Synack APIs
 """
 
+import collections
+import concurrent.futures
+import json
+import re
+import requests
+import threading
+import time
+import types
 import warnings
 
+from urllib.parse import urlparse
+
 from .base import Plugin
+from synack import _json
+from synack._singleflight import SingleFlight
+
+RequestContext = collections.namedtuple('RequestContext', ['headers', 'proxies', 'verify'])
+PreparedCall = collections.namedtuple('PreparedCall', ['request', 'endpoint', 'host', 'settings', 'token'])
+
+ID_SEGMENT = re.compile(r'^(?:[0-9a-fA-F-]{32,36}|[0-9]+|(?=[a-z0-9]*[0-9])(?=[a-z0-9]*[a-z])[a-z0-9]{6,})$')
 
 
 class Api(Plugin):
+    dependencies = ['Auth', 'Debug', 'Db']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        for plugin in ['Debug', 'Db']:
-            setattr(self, plugin.lower(), self.registry.get(plugin)(self.state))
+        self._context = None
+        self._context_key = None
+        self.retry_counts = collections.Counter()
+        self._retry_lock = threading.Lock()
+        self.single_flight = SingleFlight(copy=_json.copy)
+        self._warm_lock = threading.Lock()
+        self._warm_stop = None
+
+    def build_context(self):
+        """Return the headers, proxies and TLS verification shared by every request
+
+        The context is immutable and cached. It is only rebuilt when the API
+        token, user ID or proxy settings change.
+        """
+        use_proxies = bool(self.db.use_proxies)
+        proxies = tuple(self.db.proxies.items()) if use_proxies else None
+        key = (self.db.api_token, self.db.user_id, use_proxies, proxies)
+        if key != self._context_key:
+            if use_proxies:
+                warnings.filterwarnings("ignore")
+            headers = types.MappingProxyType({
+                'Authorization': f'Bearer {key[0]}',
+                'user_id': key[1]
+            })
+            self._context = RequestContext(headers, proxies, not use_proxies)
+            self._context_key = key
+        return self._context
+
+    def build_endpoint(self, url):
+        """Return the normalized endpoint path of a request
+
+        The API base and query string are dropped and path segments that look
+        like IDs or slugs are replaced, so every task, target, etc. counts
+        against the same endpoint (tasks/v1/organizations/{id}/...).
+
+        Arguments:
+        url -- Full URL of the request
+        """
+        path = url.split('?', 1)[0].split('://', 1)[-1]
+        path = path.split('/', 1)[1] if '/' in path else ''
+        if path.startswith('api/'):
+            path = path[4:]
+        return '/'.join(['{id}' if ID_SEGMENT.match(p) else p for p in path.strip('/').split('/')])
+
+    @staticmethod
+    def build_payload(method, query=None, data=None):
+        """Return the (query string, JSON body) a request sends for its verb
+
+        GET and HEAD send the query, PUT sends its data as the query string
+        and every other verb sends its data as a JSON body.
+        """
+        if method in ('GET', 'HEAD'):
+            return query, None
+        if method == 'PUT':
+            return data, None
+        return None, data
+
+    def is_cacheable(self, endpoint):
+        """Return whether GET responses from an endpoint go through the response cache
+
+        Arguments:
+        endpoint -- Normalized endpoint path (see build_endpoint)
+        """
+        for pattern in self.state.cache_endpoints:
+            if re.search(pattern, endpoint):
+                return True
+        return False
+
+    def is_reauthable(self, res, headers=None):
+        """Return whether a request failed only because the API token expired
+
+        Such requests are replayed once after logging in again. Requests that
+        bring their own Authorization header (notifications, etc.) are not,
+        and neither are the ones Auth makes while it is logging in.
+
+        Arguments:
+        res -- Response to the request
+        headers -- Additional headers the request was made with
+        """
+        if res.status_code != 401 or not self.state.login:
+            return False
+        if headers and 'Authorization' in headers:
+            return False
+        return not self.auth.refreshing
 
     def login(self, method, path, **kwargs):
         """Modify API Request for Login
@@ -29,7 +130,7 @@ class Api(Plugin):
         if path.startswith('http'):
             base = ''
         else:
-            base = 'https://login.synack.com/api/'
+            base = self.state.login_base
         url = f'{base}{path}'
         res = self.request(method, url, **kwargs)
         return res
@@ -49,7 +150,7 @@ class Api(Plugin):
         if path.startswith('http'):
             base = ''
         else:
-            base = 'https://notifications.synack.com/api/v2/'
+            base = self.state.notifications_base
         url = f'{base}{path}'
 
         if not kwargs.get('headers'):
@@ -62,6 +163,30 @@ class Api(Plugin):
             self.db.notifications_token = ""
         return res
 
+    def prepare(self, method, path, **kwargs):
+        """Build a request now so sending it later with send_prepared() costs nothing more
+
+        The URL, headers, JSON body and send settings (proxies, TLS
+        verification) are all resolved up front. The call is only valid for
+        the API token it was built with (see PreparedCall.token).
+
+        Takes the same arguments as request()
+        """
+        url = path if path.startswith('http') else f'{self.state.api_base}{path}'
+        method = method.upper()
+        params, body = self.build_payload(method, kwargs.get('query'), kwargs.get('data'))
+        context = self.build_context()
+        headers = dict(context.headers)
+        if kwargs.get('headers'):
+            headers.update(kwargs['headers'])
+
+        session = self.state.session
+        request = session.prepare_request(requests.Request(method, url, headers=headers, params=params, json=body))
+        proxies = dict(context.proxies) if context.proxies else {}
+        settings = session.merge_environment_settings(request.url, proxies, False, context.verify, None)
+        return PreparedCall(request, self.build_endpoint(url), urlparse(url).hostname, settings,
+                            context.headers['Authorization'])
+
     def request(self, method, path, **kwargs):
         """Send API Request
 
@@ -73,66 +198,189 @@ class Api(Plugin):
         headers -- Additional headers to be added for only this request
         data -- POST body dictionary
         query -- GET query string dictionary
+        stream -- Leave the body unread so it can be consumed with iter_content()
         """
         if path.startswith('http'):
-            base = ''
+            url = path
         else:
-            base = 'https://platform.synack.com/api/'
-        url = f'{base}{path}'
+            url = f'{self.state.api_base}{path}'
 
-        if self.db.use_proxies:
-            warnings.filterwarnings("ignore")
-            verify = False
-            proxies = self.db.proxies
-        else:
-            verify = True
-            proxies = None
-
-        headers = {
-            'Authorization': f'Bearer {self.db.api_token}',
-            'user_id': self.db.user_id
-        }
-        if kwargs.get('headers'):
-            headers.update(kwargs.get('headers', {}))
+        method = method.upper()
         query = kwargs.get('query')
         data = kwargs.get('data')
+        stream = kwargs.get('stream', False)
+        params, body = self.build_payload(method, query, data)
+
+        for attempt in range(2):
+            context = self.build_context()
+            headers = context.headers
+            if kwargs.get('headers'):
+                headers = {**headers, **kwargs['headers']}
+
+            if method in ('GET', 'HEAD') and self.state.use_single_flight and not stream:
+                key = (method,
+                       url,
+                       json.dumps(params, sort_keys=True, default=str),
+                       tuple(sorted(headers.items())))
+                res = self.single_flight.do(key, lambda: self.send(method, url, headers, params, body, context))
+            else:
+                res = self.send(method, url, headers, params, body, context, stream=stream)
+
+            self.debug.log_request(method, url, res, headers=headers, query=query, data=data)
+
+            if attempt or not self.is_reauthable(res, kwargs.get('headers')):
+                break
+            try:
+                self.auth.get_api_token(force=True, stale=context.headers['Authorization'][len('Bearer '):])
+            except (Exception, SystemExit) as e:
+                # Logging in can end in sys.exit(); fail this request, not the process
+                self.debug.log('Reauthentication', f'Failed to log in again: {e}')
+                break
+            if stream:
+                res.close()
+
+        return res
+
+    def send(self, method, url, headers, params=None, body=None, context=None, stream=False, prepared=None):
+        """Send a fully built API Request, retrying and caching as configured
+
+        Arguments:
+        method -- Upper-case request method verb
+        url -- Full URL of the request
+        headers -- Complete request headers
+        params -- Query string dictionary
+        body -- JSON body dictionary
+        context -- RequestContext to use (defaults to build_context())
+        stream -- Leave the body unread so it can be consumed with iter_content()
+        prepared -- PreparedCall from prepare() to send instead of building the request
+        """
+        if context is None:
+            context = self.build_context()
+
+        endpoint = prepared.endpoint if prepared is not None else self.build_endpoint(url)
+        policy = self.state.retry_policy
+
+        cache = self.state.response_cache if method == 'GET' and not stream else None
+        if cache is not None and self.is_cacheable(endpoint):
+            cache_key = cache.build_key(url, params, context.headers['Authorization'])
+            cache_entry = cache.get(cache_key)
+            if cache_entry is not None:
+                headers = {**headers, **cache.build_validators(cache_entry)}
+        else:
+            cache = None
+
+        metrics = self.state.metrics
+        limiter = self.state.rate_limiter
+        host = prepared.host if prepared is not None else urlparse(url).hostname
+        attempt = 0
+        while True:
+            res = None
+            if limiter is not None:
+                waited = limiter.acquire(method, host, endpoint, params)
+                if waited and metrics is not None:
+                    metrics.count('synack_api_rate_limit_wait_seconds_total', waited,
+                                  help='Time requests to the Synack APIs waited for the rate limiter',
+                                  endpoint=endpoint)
+            start = time.perf_counter()
+            try:
+                if prepared is not None:
+                    res = self.state.session.send(prepared.request, **prepared.settings)
+                else:
+                    res = self.state.session.request(method,
+                                                     url,
+                                                     headers=headers,
+                                                     params=params,
+                                                     json=body,
+                                                     proxies=dict(context.proxies) if context.proxies else None,
+                                                     verify=context.verify,
+                                                     stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if metrics is not None:
+                    metrics.observe_request(method, endpoint, 'error', time.perf_counter() - start)
+                if not policy.allows(method, endpoint, attempt, exc=e):
+                    raise
+            else:
+                if metrics is not None:
+                    size = int(res.headers.get('Content-Length') or 0) if stream else len(res.content)
+                    metrics.observe_request(method, endpoint, res.status_code, time.perf_counter() - start, size)
+                if not policy.allows(method, endpoint, attempt, res=res):
+                    break
+            if res is not None and stream:
+                res.close()
+            self.set_retried(method, endpoint)
+            time.sleep(policy.get_delay(attempt, res))
+            attempt += 1
 
-        if method.upper() == 'GET':
-            res = self.state.session.get(url,
-                                         headers=headers,
-                                         proxies=proxies,
-                                         params=query,
-                                         verify=verify)
-        elif method.upper() == 'HEAD':
-            res = self.state.session.head(url,
-                                          headers=headers,
-                                          proxies=proxies,
-                                          params=query,
-                                          verify=verify)
-        elif method.upper() == 'PATCH':
-            res = self.state.session.patch(url,
-                                           json=data,
-                                           headers=headers,
-                                           proxies=proxies,
-                                           verify=verify)
-        elif method.upper() == 'POST':
-            res = self.state.session.post(url,
-                                          json=data,
-                                          headers=headers,
-                                          proxies=proxies,
-                                          verify=verify)
-        elif method.upper() == 'PUT':
-            res = self.state.session.put(url,
-                                         headers=headers,
-                                         proxies=proxies,
-                                         params=data,
-                                         verify=verify)
-
-        self.debug.log("Network Request",
-                       f"{res.status_code} -- {method.upper()} -- {url}" +
-                       f"\n\tHeaders: {headers}" +
-                       f"\n\tQuery: {query}" +
-                       f"\n\tData: {data}" +
-                       f"\n\tContent: {res.content}")
+        if cache is not None:
+            if res.status_code == 304 and cache_entry is not None:
+                res = cache.build_response(cache_entry, res)
+            elif res.status_code == 200:
+                cache.set(cache_key, res)
 
+        return _json.wrap(res)
+
+    def send_prepared(self, call):
+        """Send a request built by prepare()
+
+        It goes through the rate limiter, retry policy and metrics like any
+        other request, but is not rebuilt, and is not replayed on a 401.
+
+        Arguments:
+        call -- PreparedCall from prepare()
+        """
+        request = call.request
+        res = self.send(request.method, request.url, request.headers, prepared=call)
+        self.debug.log_request(request.method, request.url, res, headers=request.headers)
         return res
+
+    def set_retried(self, method, endpoint):
+        """Count a retry of a request in retry_counts and the metrics
+
+        Arguments:
+        method -- Request method verb
+        endpoint -- Normalized endpoint path (see build_endpoint)
+        """
+        with self._retry_lock:
+            self.retry_counts[f'{method} {endpoint}'] += 1
+        metrics = self.state.metrics
+        if metrics is not None:
+            metrics.count('synack_api_retries_total', help='Requests to the Synack APIs that were retried',
+                          method=method, endpoint=endpoint)
+
+    def set_keep_warm(self, enabled=True):
+        """Start or stop keeping connections to the platform open
+
+        A background thread sends State.keep_warm_connections concurrent HEAD
+        requests to the platform every State.keep_warm_interval seconds, so
+        that many pooled connections stay open and claims never wait for a
+        TCP and TLS handshake. They go through send(), so the rate limiter
+        and metrics see them. Setting keep_warm_connections to 0 disables it.
+
+        Arguments:
+        enabled -- Start the thread if True, stop it if False
+        """
+        with self._warm_lock:
+            if self._warm_stop is not None:
+                self._warm_stop.set()
+                self._warm_stop = None
+            if enabled and self.state.keep_warm_connections:
+                self._warm_stop = threading.Event()
+                threading.Thread(target=self._keep_warm, args=(self._warm_stop,),
+                                 name='synack-keep-warm', daemon=True).start()
+
+    def _keep_warm(self, stop):
+        parsed = urlparse(self.state.api_base)
+        url = f'{parsed.scheme}://{parsed.netloc}/'
+        connections = self.state.keep_warm_connections
+        with concurrent.futures.ThreadPoolExecutor(max_workers=connections,
+                                                   thread_name_prefix='synack-keep-warm') as executor:
+            while not stop.is_set():
+                context = self.build_context()
+                futures = [executor.submit(self.send, 'HEAD', url, {}, context=context)
+                           for _ in range(connections)]
+                for future in futures:
+                    try:
+                        future.result()
+                    except requests.exceptions.RequestException:
+                        pass
+                stop.wait(self.state.keep_warm_interval)
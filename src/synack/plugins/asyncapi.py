@@ -0,0 +1,302 @@
+"""plugins/asyncapi.py
+
+Functions to handle interacting with the Synack APIs from asyncio code
+"""
+
+import asyncio
+import functools
+import json
+import time
+
+from urllib.parse import urlparse
+
+from .base import Plugin
+from synack import _json
+from synack._singleflight import AsyncSingleFlight
+
+
+class AsyncResponse:
+    """Fully read response returned by AsyncApi.request
+
+    Mirrors the parts of requests.Response that the plugins use, so the
+    same response handling works for both clients.
+    """
+
+    def __init__(self, status_code, headers, content, url, encoding=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.url = url
+        self.encoding = encoding
+
+    def __repr__(self):
+        return f'<AsyncResponse [{self.status_code}]>'
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self, **kwargs):
+        """Return the decoded body, parsed once with the fast JSON backend"""
+        if kwargs:
+            return json.loads(self.content, **kwargs)
+        try:
+            return self.__dict__['_json']
+        except KeyError:
+            pass
+        self._json = _json.loads(self.content)
+        return self._json
+
+
+class AsyncApi(Plugin):
+    dependencies = ['Api', 'Auth', 'Db', 'Debug']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._session = None
+        self._session_loop = None
+        self.single_flight = AsyncSingleFlight(copy=_json.copy)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    @staticmethod
+    def build_params(query):
+        """Return a query dictionary as a list of pairs aiohttp accepts
+
+        Lists are expanded into repeated keys and booleans are lowercased,
+        matching how requests encodes the same dictionary.
+        """
+        if query is None:
+            return None
+        ret = list()
+        for key, value in query.items():
+            for item in value if isinstance(value, (list, tuple, set)) else [value]:
+                if isinstance(item, bool):
+                    item = str(item).lower()
+                if item is not None:
+                    ret.append((key, str(item)))
+        return ret
+
+    async def close(self):
+        """Close the underlying HTTP session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._session_loop = None
+
+    async def get_session(self):
+        """Return the aiohttp session for the running event loop"""
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=0,
+                                             limit_per_host=self.state.pool_maxsize,
+                                             keepalive_timeout=self.state.keep_alive)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    async def login(self, method, path, **kwargs):
+        """Modify API Request for Login
+
+        Arguments:
+        method -- Request method verb
+                  (GET, POST, etc.)
+        path -- API endpoint path
+                Can be an endpoint on login.synack.com or a full URL
+        headers -- Additional headers to be added for only this request
+        data -- POST body dictionary
+        query -- GET query string dictionary
+        """
+        if path.startswith('http'):
+            base = ''
+        else:
+            base = self.state.login_base
+        url = f'{base}{path}'
+        return await self.request(method, url, **kwargs)
+
+    async def notifications(self, method, path, **kwargs):
+        """Modify API Request for Notifications
+
+        Arguments:
+        method -- Request method verb
+                  (GET, POST, etc.)
+        path -- API endpoint path
+                Can be an endpoint on notifications.synack.com or a full URL
+        headers -- Additional headers to be added for only this request
+        data -- POST body dictionary
+        query -- GET query string dictionary
+        """
+        if path.startswith('http'):
+            base = ''
+        else:
+            base = self.state.notifications_base
+        url = f'{base}{path}'
+
+        if not kwargs.get('headers'):
+            kwargs['headers'] = dict()
+        kwargs['headers']['Authorization'] = "Bearer " + self.db.notifications_token
+
+        res = await self.request(method, url, **kwargs)
+        if res.status_code == 422:
+            self.db.notifications_token = ""
+        return res
+
+    async def request(self, method, path, **kwargs):
+        """Send API Request
+
+        Arguments:
+        method -- Request method verb
+                  (GET, POST, etc.)
+        path -- API endpoint path
+                Can be an endpoint on platform.synack.com or a full URL
+        headers -- Additional headers to be added for only this request
+        data -- POST body dictionary
+        query -- GET query string dictionary
+
+        A request rejected because the API token expired is replayed once
+        after logging in again, as in Api.request.
+        """
+        if path.startswith('http'):
+            url = path
+        else:
+            url = f'{self.state.api_base}{path}'
+
+        method = method.upper()
+        query = kwargs.get('query')
+        data = kwargs.get('data')
+        params, body = self.api.build_payload(method, query, data)
+
+        for attempt in range(2):
+            context = self.api.build_context()
+            headers = {k: v for k, v in context.headers.items() if v is not None}
+            if kwargs.get('headers'):
+                headers.update(kwargs['headers'])
+
+            if method in ('GET', 'HEAD') and self.state.use_single_flight:
+                key = (method,
+                       url,
+                       json.dumps(params, sort_keys=True, default=str),
+                       tuple(sorted(headers.items())))
+                res = await self.single_flight.do(key,
+                                                  lambda: self.send(method, url, headers, params, body, context))
+            else:
+                res = await self.send(method, url, headers, params, body, context)
+
+            self.debug.log_request(method, url, res, headers=headers, query=query, data=data)
+
+            if attempt or not self.api.is_reauthable(res, kwargs.get('headers')):
+                break
+            # Logging in is blocking, so keep it off the event loop
+            stale = context.headers['Authorization'][len('Bearer '):]
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(self.auth.get_api_token, force=True, stale=stale))
+            except (Exception, SystemExit) as e:
+                # Logging in can end in sys.exit(); fail this request, not the process
+                self.debug.log('Reauthentication', f'Failed to log in again: {e}')
+                break
+
+        return res
+
+    async def send(self, method, url, headers, params=None, body=None, context=None):
+        """Send a fully built API Request, retrying and caching as configured
+
+        Uses the same retry policy, retry counters and response cache as
+        Api.send, waiting with asyncio.sleep instead of blocking.
+
+        Arguments:
+        method -- Upper-case request method verb
+        url -- Full URL of the request
+        headers -- Complete request headers
+        params -- Query string dictionary
+        body -- JSON body dictionary
+        context -- RequestContext to use (defaults to Api.build_context())
+        """
+        import aiohttp
+
+        if context is None:
+            context = self.api.build_context()
+
+        proxy = None
+        if context.proxies:
+            proxy = dict(context.proxies).get('https' if url.startswith('https') else 'http')
+
+        endpoint = self.api.build_endpoint(url)
+        policy = self.state.retry_policy
+
+        cache = self.state.response_cache if method == 'GET' else None
+        if cache is not None and self.api.is_cacheable(endpoint):
+            cache_key = cache.build_key(url, params, context.headers['Authorization'])
+            cache_entry = cache.get(cache_key)
+            if cache_entry is not None:
+                headers = {**headers, **cache.build_validators(cache_entry)}
+        else:
+            cache = None
+
+        metrics = self.state.metrics
+        limiter = self.state.rate_limiter
+        host = urlparse(url).hostname
+        session = await self.get_session()
+        attempt = 0
+        while True:
+            res = None
+            if limiter is not None:
+                waited = 0.0
+                while True:
+                    delay = limiter.take(method, host, endpoint, params)
+                    if not delay:
+                        break
+                    await asyncio.sleep(delay)
+                    waited += delay
+                if waited and metrics is not None:
+                    metrics.count('synack_api_rate_limit_wait_seconds_total', waited,
+                                  help='Time requests to the Synack APIs waited for the rate limiter',
+                                  endpoint=endpoint)
+            start = time.perf_counter()
+            try:
+                async with session.request(method,
+                                           url,
+                                           headers=headers,
+                                           params=self.build_params(params),
+                                           json=body,
+                                           proxy=proxy,
+                                           ssl=context.verify) as raw:
+                    res = AsyncResponse(raw.status,
+                                        raw.headers,
+                                        await raw.read(),
+                                        str(raw.url),
+                                        raw.charset)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if metrics is not None:
+                    metrics.observe_request(method, endpoint, 'error', time.perf_counter() - start)
+                if not policy.allows(method, endpoint, attempt, exc=e):
+                    raise
+            else:
+                if metrics is not None:
+                    metrics.observe_request(method, endpoint, res.status_code, time.perf_counter() - start,
+                                            len(res.content))
+                if not policy.allows(method, endpoint, attempt, res=res):
+                    break
+            self.api.set_retried(method, endpoint)
+            await asyncio.sleep(policy.get_delay(attempt, res))
+            attempt += 1
+
+        if cache is not None:
+            if res.status_code == 304 and cache_entry is not None:
+                cached = cache.build_response(cache_entry, res)
+                res = AsyncResponse(cached.status_code, cached.headers, cached.content, res.url, cached.encoding)
+                res.from_cache = True
+            elif res.status_code == 200:
+                cache.set(cache_key, res)
+
+        return res
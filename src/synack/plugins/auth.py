@@ -3,15 +3,15 @@
 Functions related to handling and checking authentication.
 """
 
-import pyotp
+import base64
 import re
 import requests
 import json
 import subprocess
+import threading
 import time
 import sys
 import urllib3
-from bs4 import BeautifulSoup
 
 from .base import Plugin
 from urllib.parse import urlparse
@@ -19,13 +19,14 @@ from urllib.parse import urlparse
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 class Auth(Plugin):
+    dependencies = ['Api', 'Db', 'Debug', 'Users', 'Duo']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        for plugin in ['Api', 'Db', 'Users', 'Duo']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._refresh_stop = None
+        self._refresh_thread = None
         try:
             with open(f"{self.state.config_dir}/duo.json") as fp:
                 duo_config = json.load(fp)
@@ -38,8 +39,25 @@ class Auth(Plugin):
             print(f"Error loading duo.json: {e}")
             sys.exit(1)
 
+    @staticmethod
+    def build_token_expiry(token):
+        """Return the expiry time (epoch seconds) of a JWT API token
+
+        The claims are only decoded, not verified. None is returned for
+        tokens that are not JWTs or carry no exp claim.
+        """
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+            return float(exp) if exp is not None else None
+        except (AttributeError, IndexError, TypeError, ValueError):
+            return None
+
     def build_otp(self):
         """Generate and return a OTP."""
+        import pyotp
+
         totp = pyotp.TOTP(self.db.otp_secret)
         totp.digits = 7
         totp.interval = 10
@@ -47,6 +65,8 @@ class Auth(Plugin):
         return totp.now()
 
     def get_grant_token(self):
+        from bs4 import BeautifulSoup
+
         def is_json(response):
             try:
                 response.json()
@@ -59,8 +79,8 @@ class Auth(Plugin):
             print(message)
             sys.exit(1)
 
-        # Initialize a session with a cookie jar
-        session = requests.Session()
+        # Initialize a session with a cookie jar, on the shared connection pools
+        session = self.state.build_session()
         session.cookies = requests.cookies.RequestsCookieJar()
 
         # Custom headers
@@ -324,29 +344,52 @@ class Auth(Plugin):
         except Exception as e:
             exit_on_error(f"Error during final redirect: {e}")
 
-    def get_api_token(self):
-        """Log in to get a new API token."""
-        if self.users.get_profile():
-            return self.db.api_token
-
-        grant_token = self.get_grant_token()
-
-        if grant_token:
-            url = 'https://platform.synack.com/'
-            headers = {
-                'X-Requested-With': 'XMLHttpRequest'
-            }
-            query = {
-                "grant_token": grant_token
-            }
-            res = self.api.request('GET',
-                                   url + 'token',
-                                   headers=headers,
-                                   query=query)
-            if res.status_code == 200:
-                j = res.json()
-                self.db.api_token = j.get('access_token')
-                return j.get('access_token')
+    def get_api_token(self, force=False, stale=None):
+        """Log in to get a new API token.
+
+        A JWT that is valid for longer than State.token_refresh_margin seconds
+        is returned as-is without asking the platform. Other tokens are
+        checked with a profile request first.
+
+        Arguments:
+        force -- Log in even if the current token looks valid
+        stale -- Token that was just rejected
+                 If another thread already replaced it, that token is returned
+        """
+        with self._lock:
+            token = self.db.api_token
+            if stale is not None and token and token != stale:
+                return token
+            self._local.refreshing = True
+            try:
+                if not force:
+                    expiry = self.build_token_expiry(token)
+                    if expiry is not None:
+                        if expiry - time.time() > self.state.token_refresh_margin:
+                            return token
+                    elif self.users.get_profile():
+                        return self.db.api_token
+
+                grant_token = self.get_grant_token()
+
+                if grant_token:
+                    url = 'https://platform.synack.com/'
+                    headers = {
+                        'X-Requested-With': 'XMLHttpRequest'
+                    }
+                    query = {
+                        "grant_token": grant_token
+                    }
+                    res = self.api.request('GET',
+                                           url + 'token',
+                                           headers=headers,
+                                           query=query)
+                    if res.status_code == 200:
+                        j = res.json()
+                        self.db.api_token = j.get('access_token')
+                        return j.get('access_token')
+            finally:
+                self._local.refreshing = False
 
     def get_notifications_token(self):
         """Request a new Notifications Token"""
@@ -356,3 +399,49 @@ class Auth(Plugin):
             self.db.notifications_token = j['token']
             return j['token']
 
+    @property
+    def refreshing(self):
+        """Whether the current thread is inside get_api_token()"""
+        return getattr(self._local, 'refreshing', False)
+
+    def set_refresh(self, enabled=True):
+        """Start or stop refreshing the API token in the background
+
+        The thread logs in State.token_refresh_margin seconds before the JWT
+        expires, so requests never stall on an expired token. Tokens without
+        an expiry are left to the re-authentication done by Api on a 401.
+
+        Arguments:
+        enabled -- Start the refresh thread if True, stop it if False
+        """
+        with self._lock:
+            if self._refresh_stop is not None:
+                self._refresh_stop.set()
+                self._refresh_stop = None
+                self._refresh_thread = None
+            if enabled:
+                self._refresh_stop = threading.Event()
+                self._refresh_thread = threading.Thread(target=self._refresh, args=(self._refresh_stop,),
+                                                        name='synack-token-refresh', daemon=True)
+                self._refresh_thread.start()
+        return self._refresh_thread
+
+    def _refresh(self, stop):
+        retry = 30
+        while not stop.is_set():
+            expiry = self.build_token_expiry(self.db.api_token)
+            if expiry is None:
+                return
+            delay = expiry - self.state.token_refresh_margin - time.time()
+            if delay > 0:
+                stop.wait(delay)
+                continue
+            try:
+                self.get_api_token(force=True)
+            except (Exception, SystemExit) as e:
+                self.debug.log('Token Refresh', f'Failed to refresh the API token: {e}')
+            if self.build_token_expiry(self.db.api_token) == expiry:
+                stop.wait(retry)
+                retry = min(retry * 2, 600)
+            else:
+                retry = 30
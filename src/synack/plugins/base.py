@@ -1,9 +1,54 @@
+import threading
+
+_lock = threading.RLock()
+
+
 class Plugin:
     registry = {}
+    dependencies = []
 
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
         cls.registry[cls.__name__] = cls
 
-    def __init__(self, state, **kwargs):
+    def __init__(self, state, plugins=None, **kwargs):
         self.state = state
+        if plugins is None:
+            plugins = {type(self).__name__: self}
+        self.plugins = plugins
+
+    def __getattr__(self, name):
+        for plugin in type(self).dependencies:
+            if plugin.lower() == name:
+                value = self.get_plugin(plugin)
+                setattr(self, name, value)
+                return value
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def get_plugin(self, name):
+        """Return the shared instance of a plugin, building it if needed
+
+        Dependencies are resolved the first time they are used, so a plugin
+        only pays for the parts of the graph it actually touches.
+
+        Arguments:
+        name -- Name of the plugin class in the registry (Api, Db, etc.)
+        """
+        return self.resolve(name, self.state, self.plugins)
+
+    @classmethod
+    def resolve(cls, name, state, plugins):
+        """Return the instance of a plugin from a plugin graph, building it if needed
+
+        Arguments:
+        name -- Name of the plugin class in the registry (Api, Db, etc.)
+        state -- State shared by every plugin in the graph
+        plugins -- Dictionary of plugin instances making up the graph
+        """
+        if name not in plugins:
+            with _lock:
+                if name not in plugins:
+                    # Only publish the plugin once it is fully built, so
+                    # other threads never see a half-initialized instance
+                    plugins[name] = cls.registry.get(name)(state, plugins=plugins)
+        return plugins[name]
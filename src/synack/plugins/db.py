@@ -3,9 +3,12 @@
 Manipulates/Reads the database and provides it to other plugins
 """
 
-import alembic.config
-import alembic.command
+import contextlib
+import functools
+import re
 import sqlalchemy as sa
+import sqlite3
+import threading
 
 from pathlib import Path
 from sqlalchemy.orm import sessionmaker
@@ -19,6 +22,30 @@ from synack.db.models import Url
 
 from .base import Plugin
 
+_migrated = set()
+_migration_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def get_migration_heads():
+    """Return the head revisions found in the migration scripts
+
+    The scripts are scanned for their revision identifiers rather than
+    loaded through Alembic, which keeps the up-to-date check cheap.
+    """
+    versions = Path(__file__).parent.parent / 'db' / 'alembic' / 'versions'
+    revisions = set()
+    parents = set()
+    for script in versions.glob('*.py'):
+        text = script.read_text()
+        revision = re.search(r"^revision = '([0-9a-f]+)'", text, re.MULTILINE)
+        if revision:
+            revisions.add(revision.group(1))
+        down_revision = re.search(r"^down_revision = (.*)$", text, re.MULTILINE)
+        if down_revision:
+            parents.update(re.findall(r"'([0-9a-f]+)'", down_revision.group(1)))
+    return frozenset(revisions - parents)
+
 
 class Db(Plugin):
     def __init__(self, *args, **kwargs):
@@ -30,6 +57,8 @@ class Db(Plugin):
         engine = sa.create_engine(f'sqlite:///{str(self.sqlite_db)}')
         sa.event.listen(engine, 'connect', self._fk_pragma_on_connect)
         self.Session = sessionmaker(bind=engine)
+        self._config = None
+        self._config_batch = threading.local()
 
     @staticmethod
     def _fk_pragma_on_connect(dbapi_con, con_record):
@@ -189,6 +218,29 @@ class Db(Plugin):
     def api_token(self, value):
         self.set_config('api_token', value)
 
+    @contextlib.contextmanager
+    def batch_config(self):
+        """Group config changes so they are written in a single transaction
+
+        Any config property set inside the block is held back and committed
+        together when the block exits. Nothing is written if it raises.
+
+        Example:
+        with h.db.batch_config():
+            h.db.smtp_server = 'smtp.example.com'
+            h.db.smtp_port = 465
+        """
+        if getattr(self._config_batch, 'fields', None) is not None:
+            yield
+            return
+        self._config_batch.fields = dict()
+        try:
+            yield
+            fields = self._config_batch.fields
+        finally:
+            self._config_batch.fields = None
+        self.update_config(**fields)
+
     @property
     def categories(self):
         session = self.Session()
@@ -338,14 +390,26 @@ class Db(Plugin):
         session.close()
         return ret
 
+    def get_migration_current(self):
+        """Return the revision the database is currently at, if any"""
+        if not self.sqlite_db.exists():
+            return None
+        con = sqlite3.connect(str(self.sqlite_db))
+        try:
+            row = con.execute('SELECT version_num FROM alembic_version').fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            con.close()
+        return row[0] if row else None
+
     def get_config(self, name=None):
-        session = self.Session()
-        config = session.query(Config).filter_by(id=1).first()
-        if not config:
-            config = Config()
-            session.add(config)
-        session.close()
-        return getattr(config, name) if name else config
+        fields = getattr(self._config_batch, 'fields', None)
+        if name and fields and name in fields:
+            return fields[name]
+        if self._config is None:
+            self.reload()
+        return getattr(self._config, name) if name else self._config
 
     @property
     def http_proxy(self):
@@ -435,6 +499,22 @@ class Db(Plugin):
             'https': https_proxy
         }
 
+    def reload(self):
+        """Reload the config from the database
+
+        The config is read once and then served from memory, with writes going
+        straight through to the database. Call this to pick up changes made by
+        another process sharing the same database.
+        """
+        session = self.Session()
+        config = session.query(Config).filter_by(id=1).first()
+        if not config:
+            config = Config()
+            session.add(config)
+        session.close()
+        self._config = config
+        return config
+
     def remove_targets(self, **kwargs):
         session = self.Session()
         session.query(Target).filter_by(**kwargs).delete()
@@ -455,25 +535,36 @@ class Db(Plugin):
         self.set_config('scratchspace_dir', value)
 
     def set_config(self, name, value):
-        session = self.Session()
-        config = session.query(Config).filter_by(id=1).first()
-        if not config:
-            config = Config()
-            session.add(config)
-        setattr(config, name, value)
-        session.commit()
-        session.close()
+        self.update_config(**{name: value})
 
     def set_migration(self):
-        db_folder = Path(__file__).parent.parent / 'db'
-
-        config = alembic.config.Config()
-        config.set_main_option('script_location', str(db_folder / 'alembic'))
-        config.set_main_option('version_locations',
-                               str(db_folder / 'alembic/versions'))
-        config.set_main_option('sqlalchemy.url',
-                               f'sqlite:///{str(self.sqlite_db)}')
-        alembic.command.upgrade(config, 'head')
+        """Upgrade the database to the latest migration
+
+        Alembic is only invoked when the revision stored in the database
+        does not match the head revision. The result is remembered for the
+        lifetime of the process, so each database file is checked once.
+        """
+        key = str(self.sqlite_db)
+        if key in _migrated:
+            return
+        with _migration_lock:
+            if key in _migrated:
+                return
+            heads = get_migration_heads()
+            if len(heads) != 1 or self.get_migration_current() not in heads:
+                import alembic.command
+                import alembic.config
+
+                db_folder = Path(__file__).parent.parent / 'db'
+
+                config = alembic.config.Config()
+                config.set_main_option('script_location', str(db_folder / 'alembic'))
+                config.set_main_option('version_locations',
+                                       str(db_folder / 'alembic/versions'))
+                config.set_main_option('sqlalchemy.url',
+                                       f'sqlite:///{key}')
+                alembic.command.upgrade(config, 'head')
+            _migrated.add(key)
 
     @property
     def discord_webhook_url(self):
@@ -559,6 +650,30 @@ class Db(Plugin):
     def template_dir(self, value):
         self.set_config('template_dir', value)
 
+    def update_config(self, **fields):
+        """Apply several config changes in a single transaction
+
+        Arguments:
+        fields -- Config columns and their new values
+                  (smtp_server='smtp.example.com', smtp_port=465, etc.)
+        """
+        batch = getattr(self._config_batch, 'fields', None)
+        if batch is not None:
+            batch.update(fields)
+            return
+        if not fields:
+            return
+        session = self.Session(expire_on_commit=False)
+        config = session.query(Config).filter_by(id=1).first()
+        if not config:
+            config = Config()
+            session.add(config)
+        for name, value in fields.items():
+            setattr(config, name, value)
+        session.commit()
+        session.close()
+        self._config = config
+
     @property
     def urls(self):
         session = self.Session()
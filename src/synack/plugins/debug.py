@@ -3,20 +3,130 @@
 Defines the methods to increase verbosity and aid in debugging
 """
 
+import json
+import random
+import re
+import threading
+
 from datetime import datetime
 
 from .base import Plugin
 
+REDACTED_HEADERS = ('authorization', 'cookie', 'set-cookie', 'x-csrf-token')
+TOKEN_PATTERN = re.compile(r'eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]*|(?<=Bearer )[^\s\'",]+')
+
 
 class Debug(Plugin):
+    dependencies = ['Db']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        for plugin in ['Db']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+        self._enabled = None
+        self._fp = None
+        self._fp_path = None
+        self._lock = threading.Lock()
+
+    def build_body(self, res):
+        """Return a response body for logging, truncated to State.debug_body_limit bytes"""
+        if not getattr(res, '_content_consumed', True):
+            return '<streamed>'
+        content = res.content or b''
+        limit = self.state.debug_body_limit
+        text = content[:limit].decode('utf-8', errors='replace')
+        if limit is not None and len(content) > limit:
+            text += f'... ({len(content)} bytes)'
+        return self.build_redacted(text)
+
+    def build_headers(self, headers):
+        """Return a copy of request headers with credentials redacted"""
+        ret = dict()
+        for key, value in (headers or {}).items():
+            if key.lower() in REDACTED_HEADERS and value:
+                value = str(value).split(' ')[0] + ' [REDACTED]' if ' ' in str(value) else '[REDACTED]'
+            ret[key] = value
+        return ret
+
+    @staticmethod
+    def build_redacted(text):
+        """Replace bearer tokens and JWTs found in text"""
+        return TOKEN_PATTERN.sub('[REDACTED]', text)
+
+    @property
+    def enabled(self):
+        """Whether debugging is on
+
+        The flag from the database is read once. State.debug, which the
+        Db.debug setter also updates, takes precedence over it.
+        """
+        if self.state.debug is not None:
+            return self.state.debug
+        if self._enabled is None:
+            self._enabled = bool(self.db.get_config('debug'))
+        return self._enabled
 
     def log(self, title, message):
-        if self.db.debug:
+        """Print a debug message
+
+        Arguments:
+        title -- Short title of the message
+        message -- Message text, or a function returning it
+                   A function is only called when debugging is on
+        """
+        if self.enabled:
+            if callable(message):
+                message = message()
             t = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
             print(f'{t} -- {title.upper()}\n\t{message}')
+            self.write({'time': t, 'title': title, 'message': message})
+
+    def log_request(self, method, url, res, headers=None, query=None, data=None):
+        """Log a network request without doing any work while debugging is off
+
+        Requests are sampled at State.debug_sample_rate, bodies are truncated
+        and credentials are redacted from headers, query, data and body.
+
+        Arguments:
+        method -- Request method verb
+        url -- Full URL of the request
+        res -- Response to the request
+        headers -- Request headers
+        query -- GET query string dictionary
+        data -- Request body dictionary
+        """
+        if not self.enabled:
+            return
+        if self.state.debug_sample_rate < 1 and random.random() >= self.state.debug_sample_rate:
+            return
+        t = datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S")
+        record = {
+            'time': t,
+            'title': 'Network Request',
+            'status': res.status_code,
+            'method': method,
+            'url': self.build_redacted(url),
+            'headers': self.build_headers(headers),
+            'query': self.build_redacted(str(query)) if query is not None else None,
+            'data': self.build_redacted(str(data)) if data is not None else None,
+            'content': self.build_body(res),
+        }
+        print(f"{t} -- NETWORK REQUEST\n\t" +
+              f"{record['status']} -- {method} -- {record['url']}" +
+              f"\n\tHeaders: {record['headers']}" +
+              f"\n\tQuery: {record['query']}" +
+              f"\n\tData: {record['data']}" +
+              f"\n\tContent: {record['content']}")
+        self.write(record)
+
+    def write(self, record):
+        """Append a record to State.debug_log_file as a JSON line, if set"""
+        path = self.state.debug_log_file
+        if not path:
+            return
+        with self._lock:
+            if self._fp is None or self._fp_path != path:
+                if self._fp is not None:
+                    self._fp.close()
+                self._fp = open(path, 'a')
+                self._fp_path = path
+            self._fp.write(json.dumps(record, default=str) + '\n')
+            self._fp.flush()
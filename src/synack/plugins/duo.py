@@ -1,8 +1,5 @@
 import time
 import pathlib
-from Crypto.PublicKey import RSA
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA512
 
 
 import urllib.parse
@@ -13,8 +10,6 @@ import email.utils
 import json
 import urllib3
 
-import requests
-
 from urllib.parse import urlparse
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -28,6 +23,8 @@ class Duo(Plugin):
         super().__init__(*args, **kwargs)
 
     def import_key(self, keyfile):
+        from Crypto.PublicKey import RSA
+
         print(f"Importing key from {keyfile}")
         if issubclass(type(keyfile), io.IOBase):
             self.pubkey = RSA.import_key(keyfile.read())
@@ -64,6 +61,9 @@ class Duo(Plugin):
 
 
     def generate_signature(self, method, path, time, data):
+        from Crypto.Hash import SHA512
+        from Crypto.Signature import pkcs1_15
+
         message = (time + "\n" + method + "\n" + self.host.lower() + "\n" +
                    path + '\n' + urllib.parse.urlencode(data)).encode('ascii')
 
@@ -81,7 +81,7 @@ class Duo(Plugin):
                 "hsm_status": "true", "pkpush": "rsa-sha512"}
 
         signature = self.generate_signature("GET", path, time, data)
-        r = requests.get(f"https://{self.host}{path}", params=data, verify=False, headers={
+        r = self.state.mount_host(self.host).get(f"https://{self.host}{path}", params=data, verify=False, headers={
                          "Authorization": signature, "x-duo-date": time, "host": self.host})
 
         return r.json()
@@ -94,7 +94,7 @@ class Duo(Plugin):
                 "hsm_status": "true", "pkpush": "rsa-sha512"}
 
         signature = self.generate_signature("POST", path, time, data)
-        r = requests.post(f"https://{self.host}{path}", data=data, verify=False, headers={
+        r = self.state.mount_host(self.host).post(f"https://{self.host}{path}", data=data, verify=False, headers={
                           "Authorization": signature, "x-duo-date": time, "host": self.host, "txId": transactionid})
 
         return r.json()
@@ -106,7 +106,7 @@ class Duo(Plugin):
         data = {"akey": self.akey, "token": token}
 
         signature = self.generate_signature("POST", path, time, data)
-        r = requests.post(f"https://{self.host}{path}", data=data, verify=False, headers={
+        r = self.state.mount_host(self.host).post(f"https://{self.host}{path}", data=data, verify=False, headers={
                           "Authorization": signature, "x-duo-date": time, "host": self.host})
     def device_info(self):
         dt = datetime.datetime.utcnow()
@@ -116,6 +116,6 @@ class Duo(Plugin):
                 "hsm_status": "true", "pkpush": "rsa-sha512"}
 
         signature = self.generate_signature("GET", path, time, data)
-        r = requests.get(f"https://{self.host}{path}", params=data, verify=False, headers={
+        r = self.state.mount_host(self.host).get(f"https://{self.host}{path}", params=data, verify=False, headers={
                          "Authorization": signature, "x-duo-date": time, "host": self.host})
         return r.json()
@@ -3,20 +3,12 @@
 Functions dealing with hydra
 """
 
-import json
-import time
-
 from .base import Plugin
 from datetime import datetime
 
 
 class Hydra(Plugin):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        for plugin in ['Api', 'Db']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+    dependencies = ['Api', 'AsyncApi', 'Db']
 
     def build_db_input(self, results):
         """Format the Hydra output so that it can be ingested into the DB"""
@@ -67,15 +59,44 @@ class Hydra(Plugin):
                 'listing_uids': target.slug,
                 'q': '+port_is_open:true'
             }
-            time.sleep(page*0.01)
             res = self.api.request('GET',
                                    'hydra_search/search',
                                    query=query)
             if res.status_code == 200:
-                curr_results = json.loads(res.content)
+                curr_results = res.json()
                 results.extend(curr_results)
                 if len(curr_results) == 10 and page < max_page:
                     results.extend(self.get_hydra(page=page+1, max_page=max_page, **kwargs))
             if update_db:
                 self.db.add_ports(self.build_db_input(results))
             return results
+
+    async def get_hydra_async(self, page=1, max_page=5, update_db=True, **kwargs):
+        """Get Hydra results for a target without blocking the event loop
+
+        Takes the same arguments as get_hydra()
+        """
+        max_page = 1000 if max_page == 0 else max_page
+        results = list()
+        targets = self.db.find_targets(**kwargs)
+        if targets:
+            target = targets[0]
+            while page <= max_page:
+                query = {
+                    'page': page,
+                    'listing_uids': target.slug,
+                    'q': '+port_is_open:true'
+                }
+                res = await self.asyncapi.request('GET',
+                                                  'hydra_search/search',
+                                                  query=query)
+                if res.status_code != 200:
+                    break
+                curr_results = res.json()
+                results.extend(curr_results)
+                if len(curr_results) != 10:
+                    break
+                page += 1
+            if update_db:
+                self.db.add_ports(self.build_db_input(results))
+            return results
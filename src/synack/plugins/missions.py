@@ -3,21 +3,37 @@
 Functions related to handling, viewing, claiming, etc. missions
 """
 
+import collections
+import concurrent.futures
+import functools
+import math
 import operator
 import random
+import requests
+import threading
+import time
 
 from datetime import datetime
 
 from .base import Plugin
+from synack._poll import PollScheduler
+
+PLAN_MAX_STATES = 4096
 
 
 class Missions(Plugin):
+    dependencies = ['Api', 'AsyncApi', 'Db', 'Targets', 'Templates']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        for plugin in ['Api', 'Db', 'Targets', 'Templates']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+        self._claim_executor = None
+        self._notify_executor = None
+        self._page_executor = None
+        self._prepared = dict()
+        self._wallet = None
+        self._wallet_at = 0
+        self._wallet_lock = threading.Lock()
+        self._executor_lock = threading.Lock()
 
     def build_order(self, missions, sort="payout-high"):
         """Sort a list of missions by what's desired first
@@ -42,6 +58,68 @@ class Missions(Plugin):
             missions.reverse()
         return missions
 
+    @staticmethod
+    def build_plan(missions, budget):
+        """Return the missions whose payouts add up to the most without exceeding budget
+
+        This is a 0/1 knapsack where each mission weighs its payout, solved
+        over the reachable totals in units of the largest common divisor of
+        the payouts. When several subsets reach the same total, the one found
+        first in the given order wins, so sort the missions with
+        build_order() beforehand. If there are more than PLAN_MAX_STATES
+        totals to track, missions are taken greedily in the given order
+        instead.
+
+        Arguments:
+        missions -- A list of missions
+        budget -- Amount left in the mission wallet
+        """
+        amounts = [int(round(mission["payout"]["amount"] * 100)) for mission in missions]
+        budget = int(round(budget * 100))
+        if sum(amounts) <= budget:
+            return list(missions)
+        fits = [i for i, amount in enumerate(amounts) if 0 < amount <= budget]
+        step = functools.reduce(math.gcd, (amounts[i] for i in fits), 0) or 1
+        budget //= step
+
+        best = {0: None}
+        for i in fits:
+            amount = amounts[i] // step
+            for total in list(best):
+                new = total + amount
+                if new <= budget and new not in best:
+                    best[new] = (total, i)
+            if len(best) > PLAN_MAX_STATES:
+                chosen = list()
+                for i in fits:
+                    if amounts[i] // step <= budget:
+                        chosen.append(i)
+                        budget -= amounts[i] // step
+                break
+        else:
+            chosen = list()
+            total = max(best)
+            while best[total] is not None:
+                total, i = best[total]
+                chosen.append(i)
+        return [missions[i] for i in sorted(chosen)]
+
+    def build_status(self, mission, status, res):
+        """Return the outcome of a mission transition
+
+        Arguments:
+        mission -- A single mission
+        status -- Transition that was requested (CLAIM, DISCLAIM, etc.)
+        res -- Response to the transition request, or None if it failed
+        """
+        return {
+            "target": mission["listingUid"],
+            "title": mission["title"],
+            "payout": str(mission["payout"]["amount"]),
+            "status": status,
+            "success": True if res is not None and res.status_code == 201 else False
+        }
+
     def build_summary(self, missions):
         """Return a basic summary from a list of missions
 
@@ -77,10 +155,50 @@ class Missions(Plugin):
             ret['value'] = ret['value'] + m['payout']['amount']
         return ret
 
+    def build_transition(self, mission, status):
+        """Return the path and body of a mission transition request
+
+        Arguments:
+        mission -- A single mission
+        status -- Transition to request (CLAIM, DISCLAIM, etc.)
+        """
+        orgId = mission["organizationUid"]
+        listingId = mission["listingUid"]
+        campaignId = mission["campaignUid"]
+        taskId = mission["id"]
+        path = ('tasks/v1' +
+                '/organizations/' + orgId +
+                '/listings/' + listingId +
+                '/campaigns/' + campaignId +
+                '/tasks/' + taskId +
+                '/transitions')
+        return path, {"type": status}
+
+    def get_claim_executor(self):
+        """Return the thread pool claims are sent from, sized by State.claim_workers"""
+        if self._claim_executor is None:
+            with self._executor_lock:
+                if self._claim_executor is None:
+                    self._claim_executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.state.claim_workers, thread_name_prefix='synack-claim')
+        return self._claim_executor
+
+    def get_notify_executor(self):
+        """Return the single thread that runs notify callbacks off the claim path"""
+        if self._notify_executor is None:
+            with self._executor_lock:
+                if self._notify_executor is None:
+                    self._notify_executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix='synack-notify')
+        return self._notify_executor
+
     def get(self, status="PUBLISHED",
             max_pages=1, page=1, per_page=20, listing_uids=None):
         """Get a list of missions given a status
 
+        Once the first page comes back full, the following pages are fetched
+        concurrently (see get_pages).
+
         Arguments:
         status -- String matching the type of missions
                   (PUBLISHED, CLAIMED, FOR_REVIEW, APPROVED)
@@ -91,26 +209,40 @@ class Missions(Plugin):
                     (Bad: per_page=5000, per_page=1&max_pages=10)
         listing_uids -- A specific listing ID to check for missions
         """
-        query = {
-                'status': status,
-                'perPage': per_page,
-                'page': page,
-                'viewed': "true"
-        }
-        if listing_uids:
-            query["listingUids"] = listing_uids
-        res = self.api.request('GET',
-                               'tasks/v2/tasks',
-                               query=query)
-        if res.status_code == 200:
-            ret = res.json()
-            if len(ret) == per_page and page < max_pages:
-                new = self.get(status,
-                               max_pages,
-                               page+1,
-                               per_page)
-                ret.extend(new)
-            return ret
+        pages = self.get_pages(status, max_pages, page, per_page, listing_uids)
+        ret = next(pages, None)
+        if ret is not None:
+            for curr in pages:
+                ret.extend(curr)
+        return ret
+
+    async def get_async(self, status="PUBLISHED",
+                        max_pages=1, page=1, per_page=20, listing_uids=None):
+        """Get a list of missions given a status without blocking the event loop
+
+        Takes the same arguments as get()
+        """
+        ret = None
+        while page <= max_pages:
+            query = {
+                    'status': status,
+                    'perPage': per_page,
+                    'page': page,
+                    'viewed': "true"
+            }
+            if listing_uids:
+                query["listingUids"] = listing_uids
+            res = await self.asyncapi.request('GET',
+                                              'tasks/v2/tasks',
+                                              query=query)
+            if res.status_code != 200:
+                break
+            curr = res.json()
+            ret = curr if ret is None else ret + curr
+            if len(curr) != per_page:
+                break
+            page += 1
+        return ret
 
     def get_approved(self):
         """Get a list of missions currently approved"""
@@ -143,6 +275,23 @@ class Missions(Plugin):
         if res.status_code == 204:
             return int(res.headers.get('x-count', 0))
 
+    async def get_count_async(self, status="PUBLISHED", listing_uids=None):
+        """Get the number of missions currently available without blocking the event loop
+
+        Takes the same arguments as get_count()
+        """
+        query = {
+            "status": status,
+            "viewed": "false",
+        }
+        if listing_uids:
+            query["listingUid"] = listing_uids
+        res = await self.asyncapi.request('HEAD',
+                                          'tasks/v1/tasks',
+                                          query=query)
+        if res.status_code == 204:
+            return int(res.headers.get('x-count', 0))
+
     def get_evidences(self, mission):
         """Download the evidences for a single mission
 
@@ -166,6 +315,111 @@ class Missions(Plugin):
         """Get a list of missions currently in review"""
         return self.get("FOR_REVIEW")
 
+    def get_iter(self, status="PUBLISHED",
+                 max_pages=1, page=1, per_page=20, listing_uids=None):
+        """Yield missions given a status as their pages arrive
+
+        Takes the same arguments as get()
+        """
+        for curr in self.get_pages(status, max_pages, page, per_page, listing_uids):
+            yield from curr
+
+    def get_page(self, status="PUBLISHED", page=1, per_page=20, listing_uids=None):
+        """Get a single page of missions given a status
+
+        Returns None if the request failed.
+
+        Arguments:
+        status -- String matching the type of missions
+        page -- Page to get
+        per_page -- Missions per page
+        listing_uids -- A specific listing ID to check for missions
+        """
+        query = {
+                'status': status,
+                'perPage': per_page,
+                'page': page,
+                'viewed': "true"
+        }
+        if listing_uids:
+            query["listingUids"] = listing_uids
+        res = self.api.request('GET',
+                               'tasks/v2/tasks',
+                               query=query)
+        if res.status_code == 200:
+            return res.json()
+
+    def get_page_executor(self):
+        """Return the thread pool pages are fetched from, sized by State.page_workers"""
+        if self._page_executor is None:
+            with self._executor_lock:
+                if self._page_executor is None:
+                    self._page_executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.state.page_workers, thread_name_prefix='synack-page')
+        return self._page_executor
+
+    def get_pages(self, status="PUBLISHED",
+                  max_pages=1, page=1, per_page=20, listing_uids=None):
+        """Yield the pages of missions given a status, in order
+
+        The first page is fetched on its own. If it is full, up to
+        State.page_workers of the following pages are kept in flight at
+        once, until a page comes back short or max_pages is reached.
+
+        Takes the same arguments as get()
+        """
+        curr = self.get_page(status, page, per_page, listing_uids)
+        if curr is None:
+            return
+        yield curr
+        if len(curr) != per_page:
+            return
+
+        executor = self.get_page_executor()
+        pending = collections.deque()
+        page += 1
+        try:
+            while True:
+                while page <= max_pages and len(pending) < self.state.page_workers:
+                    pending.append(executor.submit(self.get_page, status, page, per_page, listing_uids))
+                    page += 1
+                if not pending:
+                    return
+                curr = pending.popleft().result()
+                if curr is None:
+                    return
+                yield curr
+                if len(curr) != per_page:
+                    return
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def get_wallet(self, refresh=False, max_age=None):
+        """Return the mission wallet as {"limit": ..., "claimed": ...}
+
+        The answer is cached and kept up to date locally as missions are
+        claimed and released.
+
+        Arguments:
+        refresh -- Ignore the cached wallet and ask the platform
+        max_age -- Oldest cached wallet to return, in seconds
+                   (defaults to State.wallet_ttl)
+        """
+        if max_age is None:
+            max_age = self.state.wallet_ttl
+        with self._wallet_lock:
+            if not refresh and self._wallet is not None and time.monotonic() - self._wallet_at < max_age:
+                return dict(self._wallet)
+        limit = self.get_wallet_limit()
+        claimed = self.get_wallet_claimed()
+        if limit is None or claimed is None:
+            return None
+        with self._wallet_lock:
+            self._wallet = {"limit": limit, "claimed": claimed}
+            self._wallet_at = time.monotonic()
+            return dict(self._wallet)
+
     def get_wallet_claimed(self):
         """Get Current Claimed Amount for Mission Wallet"""
         res = self.api.request('GET',
@@ -183,11 +437,68 @@ class Missions(Plugin):
     def set_claimed(self, mission):
         """Try to claim a single mission
 
+        A claim prepared by set_prepared() is sent as-is, unless
+        State.use_prepared_claims is off. If the API token changed since, or
+        the prepared claim is rejected with a 401, the claim is built again
+        and sent the usual way.
+
         Arguments:
         mission -- A single mission
         """
+        call = self._prepared.pop(mission.get("id"), None) if self.state.use_prepared_claims else None
+        if call is not None and call.token == f'Bearer {self.db.api_token}':
+            res = self.api.send_prepared(call)
+            if res.status_code != 401:
+                return self.set_wallet(mission, self.build_status(mission, "CLAIM", res), res)
         return self.set_status(mission, "CLAIM")
 
+    def set_claimed_many(self, missions, sort="payout-high", limit=None, detected=None, notify=None):
+        """Claim several missions at once, best first
+
+        The claims are sent concurrently from the claim thread pool, in the
+        order given by build_order(). Each outcome gets a "latency": seconds
+        from detection to the answer of the claim request.
+
+        Arguments:
+        missions -- A list of missions
+        sort -- Order to claim them in (see build_order)
+        limit -- Only claim this many of the best missions
+        detected -- time.perf_counter() value of when the missions were seen
+                    (defaults to now)
+        notify -- Function called with each outcome as it arrives
+                  It runs on a background thread, never delaying a claim
+        """
+        if detected is None:
+            detected = time.perf_counter()
+        missions = self.build_order(list(missions), sort)[:limit]
+        executor = self.get_claim_executor()
+        futures = [executor.submit(self._claim, mission, detected, notify) for mission in missions]
+        return [future.result() for future in futures]
+
+    def set_claimed_planned(self, missions, sort="payout-high", limit=None, detected=None, notify=None):
+        """Claim the missions that fill the mission wallet best
+
+        Only the subset chosen by build_plan() for the room left in the
+        wallet (see get_wallet) is claimed, so no request is spent on claims
+        the wallet limit would refuse. The cached wallet is used however old
+        it is, so the platform is only asked when there is none; watch()
+        refreshes it between polls. Takes the same arguments as
+        set_claimed_many().
+        """
+        wallet = self.get_wallet(max_age=math.inf)
+        missions = self.build_order(list(missions), sort)
+        if wallet is not None:
+            missions = self.build_plan(missions, wallet["limit"] - wallet["claimed"])
+        return self.set_claimed_many(missions, sort, limit, detected, notify)
+
+    async def set_claimed_async(self, mission):
+        """Try to claim a single mission without blocking the event loop
+
+        Arguments:
+        mission -- A single mission
+        """
+        return await self.set_status_async(mission, "CLAIM")
+
     def set_disclaimed(self, mission):
         """Try to release a single mission
 
@@ -225,34 +536,151 @@ class Missions(Plugin):
                     ret["codename"] = mission["listingCodename"]
                     return ret
 
+    def set_prepared(self, missions):
+        """Prepare the claim requests of missions ahead of time
+
+        Only worth it when missions are known well before they are claimed:
+        preparing a claim costs about as much as building it when claiming,
+        so watch() does not prepare anything. Claims already prepared with
+        the current API token are kept, and those of missions no longer in
+        the list are dropped.
+
+        Arguments:
+        missions -- List of available missions
+        """
+        token = f'Bearer {self.db.api_token}'
+        prepared = dict()
+        for mission in missions:
+            call = self._prepared.get(mission["id"])
+            if call is None or call.token != token:
+                path, data = self.build_transition(mission, "CLAIM")
+                call = self.api.prepare('POST', path, data=data)
+            prepared[mission["id"]] = call
+        self._prepared = prepared
+        return prepared
+
     def set_status(self, mission, status):
         """Interact with single mission
 
         Arguments:
         mission -- A single mission
         """
-        data = {
-            "type": status
-        }
-        orgId = mission["organizationUid"]
-        listingId = mission["listingUid"]
-        campaignId = mission["campaignUid"]
-        taskId = mission["id"]
-        payout = str(mission["payout"]["amount"])
-        title = mission["title"]
-
-        res = self.api.request('POST',
-                               'tasks/v1' +
-                               '/organizations/' + orgId +
-                               '/listings/' + listingId +
-                               '/campaigns/' + campaignId +
-                               '/tasks/' + taskId +
-                               '/transitions',
-                               data=data)
-        return {
-            "target": listingId,
-            "title": title,
-            "payout": payout,
-            "status": status,
-            "success": True if res.status_code == 201 else False
-        }
+        path, data = self.build_transition(mission, status)
+        res = self.api.request('POST', path, data=data)
+        return self.set_wallet(mission, self.build_status(mission, status, res), res)
+
+    async def set_status_async(self, mission, status):
+        """Interact with single mission without blocking the event loop
+
+        Arguments:
+        mission -- A single mission
+        """
+        path, data = self.build_transition(mission, status)
+        res = await self.asyncapi.request('POST', path, data=data)
+        return self.set_wallet(mission, self.build_status(mission, status, res), res)
+
+    def set_wallet(self, mission, outcome, res=None):
+        """Update the cached mission wallet after a transition and return the outcome
+
+        Arguments:
+        mission -- Mission that was transitioned
+        outcome -- Result from build_status()
+        res -- Response to the transition request
+               A 412 means the cached wallet was wrong, so it is dropped
+        """
+        with self._wallet_lock:
+            if self._wallet is not None:
+                amount = mission["payout"]["amount"]
+                if outcome["success"] and outcome["status"] == "CLAIM":
+                    self._wallet["claimed"] += amount
+                elif outcome["success"] and outcome["status"] == "DISCLAIM":
+                    self._wallet["claimed"] = max(0, self._wallet["claimed"] - amount)
+                elif res is not None and res.status_code == 412:
+                    self._wallet = None
+        return outcome
+
+    def watch(self, interval=None, sort="payout-high", limit=None, notify=None, stop=None, scheduler=None,
+              plan=True):
+        """Claim missions as soon as they are published
+
+        Polls get_count() and, whenever the count rises, claims the best of
+        the available missions with set_claimed_planned() (or with
+        set_claimed_many() when plan is False). The time between polls adapts
+        to activity (see PollScheduler) unless an interval is given.
+
+        Arguments:
+        interval -- Fixed number of seconds between two polls
+        sort -- Order to claim missions in (see build_order)
+        limit -- Claim at most this many missions per batch
+        notify -- Function called with each claim outcome, off the claim path
+        stop -- threading.Event that ends the loop when set
+        scheduler -- PollScheduler deciding the time between polls
+        plan -- Only claim the missions that fit in the mission wallet
+        """
+        if scheduler is None:
+            if interval is None:
+                scheduler = PollScheduler(metrics=self.state.metrics)
+            else:
+                scheduler = PollScheduler(interval, interval, jitter=0, budget=None, metrics=self.state.metrics)
+        stop = stop or threading.Event()
+        self.api.set_keep_warm(True)
+        try:
+            self._watch(stop, scheduler, sort, limit, notify, plan)
+        finally:
+            self.api.set_keep_warm(False)
+
+    def _watch(self, stop, scheduler, sort, limit, notify, plan):
+        claim = self.set_claimed_planned if plan else self.set_claimed_many
+        known = 0
+        if plan:
+            self._refresh_wallet()
+        while not stop.is_set():
+            retries = self.api.retry_counts['HEAD tasks/v1/tasks']
+            try:
+                count = self.get_count()
+            except requests.exceptions.RequestException:
+                count = None
+            polled_at = time.monotonic()
+            # A poll that had to be retried was throttled or failing, even if it got through
+            throttled = self.api.retry_counts['HEAD tasks/v1/tasks'] > retries
+            found = bool(count and count > known)
+            if found:
+                detected = time.perf_counter()
+                try:
+                    missions = self.get_available()
+                except requests.exceptions.RequestException:
+                    missions = None
+                if missions is not None:
+                    outcomes = claim(missions, sort, limit, detected, notify)
+                    # Missions left unclaimed stay in the count; only those
+                    # published after them should trigger another round
+                    known = count - sum(1 for outcome in outcomes if outcome["success"])
+            elif count is not None:
+                known = min(known, count)
+            scheduler.set_polled(found, failed=count is None or throttled, at=polled_at)
+            if plan and not found:
+                # Between polls, never between detecting missions and claiming them
+                self._refresh_wallet()
+            stop.wait(scheduler.get_interval())
+
+    def _claim(self, mission, detected, notify=None):
+        try:
+            ret = self.set_claimed(mission)
+        except requests.exceptions.RequestException as e:
+            ret = self.build_status(mission, "CLAIM", None)
+            ret["error"] = str(e)
+        ret["latency"] = time.perf_counter() - detected
+        metrics = self.state.metrics
+        if metrics is not None:
+            metrics.observe('synack_claim_latency_seconds', ret["latency"],
+                            help='Time from detecting a mission to the answer of its claim',
+                            success=str(ret["success"]).lower())
+        if notify is not None:
+            self.get_notify_executor().submit(notify, ret)
+        return ret
+
+    def _refresh_wallet(self):
+        try:
+            self.get_wallet()
+        except requests.exceptions.RequestException:
+            pass
@@ -3,18 +3,51 @@
 This contains the Templates class
 """
 
+import concurrent.futures
+import hashlib
 import json
+import os
+import requests
 
 from .base import Plugin
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class Scratchspace(Plugin):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        for plugin in ['Api', 'Db']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+    dependencies = ['Api', 'Db']
+
+    def build_download(self, attachment, dest_file):
+        """Download an attachment to dest_file through a temporary .part file
+
+        The body is streamed to disk in chunks. A .part file left by an
+        interrupted download is resumed with a Range request, and the file is
+        only renamed into place once it matches the size and checksum the API
+        reported, if any. Returns None when the download failed, whether on
+        the network or on disk; whatever was received is kept in the .part
+        file for the next attempt to resume.
+
+        Arguments:
+        attachment -- Attachment dictionary from Targets.get_attachments()
+        dest_file -- Path to save the attachment to
+        """
+        try:
+            return self._download(attachment, dest_file)
+        except (requests.exceptions.RequestException, OSError):
+            return None
+
+    @staticmethod
+    def build_expected(attachment):
+        """Return the (size, hash algorithm, hex digest) an attachment should have
+
+        Values the API did not report are None.
+        """
+        size = attachment.get('size', attachment.get('file_size'))
+        size = int(size) if size is not None else None
+        for algorithm in ('sha256', 'sha1', 'md5'):
+            if attachment.get(algorithm):
+                return size, algorithm, attachment[algorithm].lower()
+        return size, None, None
 
     def build_filepath(self, filename, target=None, codename=None):
         if target:
@@ -27,6 +60,21 @@ class Scratchspace(Plugin):
             f = f / filename
             return f
 
+    @staticmethod
+    def is_current(path, size=None, algorithm=None, digest=None):
+        """Return whether a file exists and matches the given size and checksum"""
+        if not path.exists():
+            return False
+        if size is not None and path.stat().st_size != size:
+            return False
+        if algorithm:
+            h = hashlib.new(algorithm)
+            with open(path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    h.update(chunk)
+            return h.hexdigest() == digest
+        return True
+
     def set_assets_file(self, content, target=None, codename=None):
         if target or codename:
             if type(content) in [list, set]:
@@ -46,22 +94,56 @@ class Scratchspace(Plugin):
                 return dest_file
 
     def set_download_attachments(self, attachments, target=None, codename=None, prompt_overwrite=True, overwrite=True):
+        """Download the attachments of a target into its scratchspace folder
+
+        Files already on disk with the size (and checksum, when reported) the
+        API lists are kept without asking. The rest are downloaded by up to
+        State.download_workers threads at once. Only the paths of the files
+        that are in place are returned; a failed download does not stop the
+        others.
+
+        Arguments:
+        attachments -- List of attachment dictionaries from Targets.get_attachments()
+        target -- Target whose folder to save to
+        codename -- Codename of the target whose folder to save to
+        prompt_overwrite -- Ask before replacing an existing file
+        overwrite -- Replace existing files when not prompting
+        """
         downloads = list()
+        if not (target or codename):
+            return downloads
+
+        pending = list()
         for attachment in attachments:
-            overwrite_current = overwrite
-            if target or codename:
-                dest_file = self.build_filepath(attachment.get('filename'), target=target, codename=codename)
-                if prompt_overwrite and dest_file.exists():
+            dest_file = self.build_filepath(attachment.get('filename'), target=target, codename=codename)
+            if dest_file.exists():
+                expected = self.build_expected(attachment)
+                if expected[0] is not None and self.is_current(dest_file, *expected):
+                    downloads.append(dest_file)
+                    continue
+                overwrite_current = overwrite
+                if prompt_overwrite:
                     ans = input(f'{attachment.get("filename")} exists. Overwrite? [y/N]: ')
                     overwrite_current = ans.lower().startswith('y')
-                if overwrite_current or not dest_file.exists():
-                    res = self.api.request('GET', attachment.get('url'))
-                    if res.status_code == 200:
-                        with open(dest_file, 'wb') as fp:
-                            fp.write(res.content)
-                            downloads.append(dest_file)
+                if not overwrite_current:
+                    continue
+            pending.append((attachment, dest_file))
+
+        if pending:
+            workers = max(1, min(self.state.download_workers or 1, len(pending)))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for dest_file in executor.map(lambda job: self.build_download(*job), pending):
+                    if dest_file:
+                        downloads.append(dest_file)
         return downloads
 
+    @staticmethod
+    def set_download_body(res, path, mode):
+        """Write the body of a streamed response to a file chunk by chunk"""
+        with open(path, mode) as fp:
+            for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                fp.write(chunk)
+
     def set_hosts_file(self, content, target=None, codename=None):
         if target or codename:
             if type(content) in [list, set]:
@@ -70,3 +152,31 @@ class Scratchspace(Plugin):
             with open(dest_file, 'w') as fp:
                 fp.write(content)
                 return dest_file
+
+    def _download(self, attachment, dest_file):
+        part_file = dest_file.with_name(f'{dest_file.name}.part')
+        size, algorithm, digest = self.build_expected(attachment)
+        offset = part_file.stat().st_size if part_file.exists() else 0
+        if size is not None and offset > size:
+            offset = 0
+
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+        res = self.api.request('GET', attachment.get('url'), headers=headers, stream=True)
+        try:
+            if res.status_code == 206 and offset:
+                self.set_download_body(res, part_file, 'ab')
+            elif res.status_code == 200:
+                self.set_download_body(res, part_file, 'wb')
+            elif res.status_code != 416 or not offset:
+                return None
+        finally:
+            res.close()
+
+        if size is not None and part_file.exists() and part_file.stat().st_size < size:
+            # The body ended early; keep what arrived for the next attempt
+            return None
+        if not self.is_current(part_file, size, algorithm, digest):
+            part_file.unlink(missing_ok=True)
+            return None
+        os.replace(part_file, dest_file)
+        return dest_file
@@ -3,20 +3,53 @@
 Functions related to handling and checking targets
 """
 
+import asyncio
 import ipaddress
 import re
+import time
 
 from urllib.parse import urlparse
 from .base import Plugin
 
 
 class Targets(Plugin):
+    dependencies = ['Api', 'AsyncApi', 'Db', 'Scratchspace']
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        for plugin in ['Api', 'Db', 'Scratchspace']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+        self._connected = None
+        self._connected_at = 0
+
+    def build_assets_path(self, target, asset_type=None, host_type=None, active='true',
+                          scope=['in', 'discovered'], sort='location', sort_dir='asc',
+                          page=1, perPage=5000, organization_uid=None):
+        """Return the assets endpoint path and query string for a target"""
+        if type(scope) == str:
+            scope = [scope]
+
+        queries = list()
+
+        queries.append(f'listingUid%5B%5D={target.slug}')
+        if organization_uid is not None:
+            queries.append(f'organizationUid%5B%5D={organization_uid}')
+        if asset_type is not None:
+            queries.append(f'assetType%5B%5D={asset_type}')
+        if host_type is not None:
+            queries.append(f'hostType%5B%5D={host_type}')
+        for item in scope:
+            queries.append(f'scope%5B%5D={item}')
+        if sort is not None:
+            queries.append(f'sort%5B%5D={sort}')
+        if active is not None:
+            queries.append(f'active={active}')
+        if sort_dir is not None:
+            queries.append(f'sortDir={sort_dir}')
+        if page is not None:
+            queries.append(f'page={page}')
+        if perPage is not None:
+            queries.append(f'perPage={perPage}')
+
+        return f'asset/v2/assets?{"&".join(queries)}'
 
     def build_codename_from_slug(self, slug):
         """Return a codename for a target given its slug
@@ -112,35 +145,34 @@ class Targets(Plugin):
                 curr = self.get_connected()
                 target = self.db.find_targets(slug=curr.get('slug'))
 
-        if type(scope) == str:
-            scope = [scope]
+        if target:
+            if type(target) is list and len(target) > 0:
+                target = target[0]
+            path = self.build_assets_path(target, asset_type, host_type, active, scope,
+                                          sort, sort_dir, page, perPage, organization_uid)
+            res = self.api.request('GET', path)
+            if res.status_code == 200:
+                if self.db.use_scratchspace:
+                    self.scratchspace.set_assets_file(res.text, target=target)
+                return res.json()
+
+    async def get_assets_async(self, target=None, asset_type=None, host_type=None, active='true',
+                               scope=['in', 'discovered'], sort='location', sort_dir='asc',
+                               page=1, perPage=5000, organization_uid=None, **kwargs):
+        """Get the assets (scope) of a target without blocking the event loop"""
+        if target is None:
+            if len(kwargs) > 0:
+                target = self.db.find_targets(**kwargs)
+            else:
+                curr = await asyncio.get_running_loop().run_in_executor(None, self.get_connected)
+                target = self.db.find_targets(slug=curr.get('slug'))
 
         if target:
             if type(target) is list and len(target) > 0:
                 target = target[0]
-            queries = list()
-
-            queries.append(f'listingUid%5B%5D={target.slug}')
-            if organization_uid is not None:
-                queries.append(f'organizationUid%5B%5D={organization_uid}')
-            if asset_type is not None:
-                queries.append(f'assetType%5B%5D={asset_type}')
-            if host_type is not None:
-                queries.append(f'hostType%5B%5D={host_type}')
-            for item in scope:
-                queries.append(f'scope%5B%5D={item}')
-            if sort is not None:
-                queries.append(f'sort%5B%5D={sort}')
-            if active is not None:
-                queries.append(f'active={active}')
-            if sort_dir is not None:
-                queries.append(f'sortDir={sort_dir}')
-            if page is not None:
-                queries.append(f'page={page}')
-            if perPage is not None:
-                queries.append(f'perPage={perPage}')
-
-            res = self.api.request('GET', f'asset/v2/assets?{"&".join(queries)}')
+            path = self.build_assets_path(target, asset_type, host_type, active, scope,
+                                          sort, sort_dir, page, perPage, organization_uid)
+            res = await self.asyncapi.request('GET', path)
             if res.status_code == 200:
                 if self.db.use_scratchspace:
                     self.scratchspace.set_assets_file(res.text, target=target)
@@ -158,8 +190,18 @@ class Targets(Plugin):
         if res.status_code == 200:
             return res.json()
 
-    def get_connected(self):
-        """Return information about the currenly selected target"""
+    def get_connected(self, refresh=False):
+        """Return information about the currenly selected target
+
+        The answer is cached for State.connected_ttl seconds, so a chain of
+        scope calls only asks the launchpoint once.
+
+        Arguments:
+        refresh -- Ignore the cached answer and ask the launchpoint
+        """
+        if not refresh and self._connected is not None and \
+                time.monotonic() - self._connected_at < self.state.connected_ttl:
+            return dict(self._connected)
         res = self.api.request('GET', 'launchpoint')
         if res.status_code == 200:
             j = res.json()
@@ -175,6 +217,8 @@ class Targets(Plugin):
                 "codename": self.build_codename_from_slug(slug),
                 "status": status
             }
+            self._connected = dict(ret)
+            self._connected_at = time.monotonic()
             return ret
 
     def get_connections(self, target=None, **kwargs):
@@ -218,17 +262,19 @@ class Targets(Plugin):
         query.update(query_changes)
         res = self.api.request('GET', 'targets', query=query)
         if res.status_code == 200:
-            self.db.add_targets(res.json(), is_registered=True)
-            return res.json()
+            ret = res.json()
+            self.db.add_targets(ret, is_registered=True)
+            return ret
 
     def get_registered_summary(self):
         """Get information on your registered targets"""
         res = self.api.request('GET', 'targets/registered_summary')
         ret = []
         if res.status_code == 200:
-            self.db.add_targets(res.json())
+            targets = res.json()
+            self.db.add_targets(targets)
             ret = dict()
-            for t in res.json():
+            for t in targets:
                 ret[t['id']] = t
         return ret
 
@@ -376,9 +422,10 @@ class Targets(Plugin):
                 slug = target[0].slug
 
         if slug is not None:
+            self._connected = None
             res = self.api.request('PUT', 'launchpoint', data={'listing_id': slug})
             if res.status_code == 200:
-                return self.get_connected()
+                return self.get_connected(refresh=True)
 
     def set_registered(self, targets=None):
         """Register all unregistered targets"""
@@ -10,12 +10,7 @@ from .base import Plugin
 
 
 class Templates(Plugin):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        for plugin in ['Alerts', 'Db', 'Targets']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+    dependencies = ['Alerts', 'Db', 'Targets']
 
     def build_filepath(self, mission, generic_ok=False):
         f = self.db.template_dir
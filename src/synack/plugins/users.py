@@ -7,16 +7,12 @@ from .base import Plugin
 
 
 class Users(Plugin):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        for plugin in ['Api', 'Db']:
-            setattr(self,
-                    plugin.lower(),
-                    self.registry.get(plugin)(self.state))
+    dependencies = ['Api', 'Db']
 
     def get_profile(self, user_id="me"):
         """Get a user's profile"""
         res = self.api.request('GET', f'profiles/{user_id}')
         if res.status_code == 200:
-            self.db.user_id = res.json().get('user_id')
-            return res.json()
+            ret = res.json()
+            self.db.user_id = ret.get('user_id')
+            return ret